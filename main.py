@@ -1,6 +1,12 @@
-import uvicorn
-
-from src.app import app
+import multiprocessing
 
 if __name__ == '__main__':
+    # report workers are spawned and import this module again, the app is only started here.
+    # freeze_support lets the frozen executable start them
+    multiprocessing.freeze_support()
+
+    import uvicorn
+
+    from src.app import app
+
     uvicorn.run(app, host="127.0.0.1", port=8000)
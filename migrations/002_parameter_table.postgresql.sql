@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS "Parameter"
+(
+    parameter_id SERIAL PRIMARY KEY,
+    name TEXT, -- название параметра
+    value TEXT -- значение параметра
+);
+
+CREATE INDEX IF NOT EXISTS idx_parameters_name ON "Parameter" (name);
@@ -0,0 +1,9 @@
+CREATE TABLE IF NOT EXISTS "Task"
+(
+    task_id SERIAL PRIMARY KEY,
+    timestamp TIMESTAMP,
+    name TEXT,
+    status TEXT,
+    created_at TIMESTAMP,
+    updated_at TIMESTAMP
+);
@@ -0,0 +1,12 @@
+CREATE TABLE IF NOT EXISTS CollectionCheckpoint
+(
+    company_id TEXT, -- id компании ozon
+    date DATE, -- дата сбора
+    next_offset INTEGER, -- с какого товара продолжать сбор
+    cursor TEXT, -- cursor последней сохраненной страницы
+    pages_done INTEGER, -- сколько страниц списка товаров сохранено
+    items_saved INTEGER, -- сколько товаров сохранено
+    finished INTEGER, -- 1 если сбор завершен
+    updated_at DATETIME,
+    PRIMARY KEY (company_id, date)
+);
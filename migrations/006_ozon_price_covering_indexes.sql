@@ -0,0 +1,10 @@
+-- страница изменений цен: фильтр по дате (и компании) с сортировкой по item_id без временного B-дерева
+CREATE INDEX IF NOT EXISTS idx_ozon_price_date_item ON OzonPrice (date, item_id);
+CREATE INDEX IF NOT EXISTS idx_ozon_price_date_company_item ON OzonPrice (date, company_id, item_id);
+
+-- цена за предыдущую дату (и последняя известная цена) читается только из индекса
+CREATE INDEX IF NOT EXISTS idx_ozon_price_company_offer_date ON OzonPrice
+    (company_id, offer_id, date, marketing_seller_price, marketing_oa_price, marketing_price);
+
+-- покрывается idx_ozon_price_date_item
+DROP INDEX IF EXISTS idx_ozon_price_date;
@@ -0,0 +1,9 @@
+-- ключ страницы изменений цен (item_id, company_id, offer_id) целиком в индексе,
+-- чтобы переход по курсору начинался с поиска по индексу, а не с пропуска строк offset
+CREATE INDEX IF NOT EXISTS idx_ozon_price_date_item_key ON OzonPrice (date, item_id, company_id, offer_id);
+CREATE INDEX IF NOT EXISTS idx_ozon_price_date_company_item_key ON OzonPrice (date, company_id, item_id, offer_id);
+DROP INDEX IF EXISTS idx_ozon_price_date_item;
+DROP INDEX IF EXISTS idx_ozon_price_date_company_item;
+
+-- страница задач по курсору (created_at, task_id)
+CREATE INDEX IF NOT EXISTS idx_task_created_at ON Task (created_at, task_id);
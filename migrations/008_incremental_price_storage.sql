@@ -0,0 +1,58 @@
+-- последняя цена каждого товара, обновляется на месте при каждом сборе
+CREATE TABLE IF NOT EXISTS LatestPrice
+(
+    company_id TEXT, -- id компании ozon
+    offer_id TEXT, --  один из id товаров
+    item_id TEXT, -- id товара ozon
+    name TEXT,
+    date DATE, -- последняя дата, когда товар был получен
+    valid_from DATE, -- с какой даты действуют текущие цены, ключ открытого интервала в PriceHistory
+    marketing_seller_price DOUBLE, -- цена продажи
+    old_price DOUBLE, -- зачеркнутая цена на карточке товара
+    marketing_price DOUBLE, -- цена с картой озона
+    marketing_oa_price DOUBLE, -- СПП
+    PRIMARY KEY (company_id, offer_id)
+);
+
+-- интервалы неизменных цен, строка добавляется только при изменении одной из цен
+CREATE TABLE IF NOT EXISTS PriceHistory
+(
+    company_id TEXT, -- id компании ozon
+    offer_id TEXT, --  один из id товаров
+    valid_from DATE, -- первая дата с этими ценами
+    valid_to DATE, -- последняя дата с этими ценами, NULL пока интервал открыт (тогда до LatestPrice.date)
+    item_id TEXT, -- id товара ozon
+    name TEXT,
+    marketing_seller_price DOUBLE, -- цена продажи
+    old_price DOUBLE, -- зачеркнутая цена на карточке товара
+    marketing_price DOUBLE, -- цена с картой озона
+    marketing_oa_price DOUBLE, -- СПП
+    PRIMARY KEY (company_id, offer_id, valid_from)
+);
+
+CREATE INDEX IF NOT EXISTS idx_price_history_company_valid_from ON PriceHistory (company_id, valid_from);
+
+-- даты, за которые собраны цены компании
+CREATE TABLE IF NOT EXISTS CollectionDate
+(
+    date DATE,
+    company_id TEXT, -- id компании ozon
+    PRIMARY KEY (date, company_id)
+);
+
+-- цены по датам в виде таблицы OzonPrice, собранные из интервалов
+CREATE VIEW IF NOT EXISTS OzonPriceView AS
+SELECT
+    h.company_id,
+    h.item_id,
+    h.offer_id,
+    h.name,
+    d.date,
+    h.marketing_seller_price,
+    h.old_price,
+    h.marketing_price,
+    h.marketing_oa_price
+FROM CollectionDate d
+JOIN PriceHistory h ON h.company_id = d.company_id AND h.valid_from <= d.date
+JOIN LatestPrice l ON l.company_id = h.company_id AND l.offer_id = h.offer_id
+WHERE d.date <= coalesce(h.valid_to, l.date);
@@ -0,0 +1,36 @@
+-- изменения цен за дату относительно предыдущей даты сбора, пересчитываются после сбора компании
+CREATE TABLE IF NOT EXISTS PriceChangeDaily
+(
+    date DATE, -- дата цен
+    company_id TEXT, -- id компании ozon
+    offer_id TEXT, --  один из id товаров
+    item_id TEXT, -- id товара ozon
+    name TEXT,
+    previous_date DATE, -- с какой датой сравниваются цены
+    today_seller_price DOUBLE, -- цена продажи
+    today_spp DOUBLE, -- marketing_price
+    today_ozon_card DOUBLE, -- marketing_oa_price
+    yesterday_seller_price DOUBLE,
+    yesterday_spp DOUBLE,
+    yesterday_ozon_card DOUBLE,
+    delta_seller_price DOUBLE, -- изменение цены, today - yesterday
+    delta_spp DOUBLE,
+    delta_ozon_card DOUBLE,
+    pct_seller_price DOUBLE, -- изменение цены в процентах от yesterday
+    pct_spp DOUBLE,
+    pct_ozon_card DOUBLE,
+    direction TEXT, -- up, down, same по карте озон, new - не было на предыдущую дату, removed - нет на эту дату
+    PRIMARY KEY (date, company_id, offer_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_price_change_daily_item ON PriceChangeDaily (date, item_id, company_id, offer_id);
+CREATE INDEX IF NOT EXISTS idx_price_change_daily_company_item ON PriceChangeDaily (date, company_id, item_id, offer_id);
+
+-- компании, для которых PriceChangeDaily за дату пересчитана после сбора
+CREATE TABLE IF NOT EXISTS PriceChangeRefresh
+(
+    date DATE,
+    company_id TEXT, -- id компании ozon
+    refreshed_at DATETIME,
+    PRIMARY KEY (date, company_id)
+);
@@ -0,0 +1,10 @@
+-- сортировка страницы цен по изменению цены, ключ курсора (изменение, item_id, company_id, offer_id) целиком в индексе
+CREATE INDEX IF NOT EXISTS idx_price_change_daily_pct_seller_price ON PriceChangeDaily (date, pct_seller_price, item_id, company_id, offer_id);
+CREATE INDEX IF NOT EXISTS idx_price_change_daily_pct_spp ON PriceChangeDaily (date, pct_spp, item_id, company_id, offer_id);
+CREATE INDEX IF NOT EXISTS idx_price_change_daily_pct_ozon_card ON PriceChangeDaily (date, pct_ozon_card, item_id, company_id, offer_id);
+CREATE INDEX IF NOT EXISTS idx_price_change_daily_delta_seller_price ON PriceChangeDaily (date, delta_seller_price, item_id, company_id, offer_id);
+CREATE INDEX IF NOT EXISTS idx_price_change_daily_delta_spp ON PriceChangeDaily (date, delta_spp, item_id, company_id, offer_id);
+CREATE INDEX IF NOT EXISTS idx_price_change_daily_delta_ozon_card ON PriceChangeDaily (date, delta_ozon_card, item_id, company_id, offer_id);
+
+-- фильтр новых и пропавших товаров
+CREATE INDEX IF NOT EXISTS idx_price_change_daily_direction ON PriceChangeDaily (date, direction, item_id, company_id, offer_id);
@@ -0,0 +1,12 @@
+-- месячные партиции цен: месяцы старше срока хранения переносятся из OzonPrice в таблицы OzonPrice_ГГГГ_ММ
+-- с одной ценой товара в неделю, старые партиции выгружаются в parquet и удаляются из базы
+CREATE TABLE IF NOT EXISTS PricePartition
+(
+    month DATE PRIMARY KEY, -- первый день месяца
+    table_name TEXT, -- таблица партиции
+    rows INTEGER, -- строк в партиции
+    source_rows INTEGER, -- строк месяца в OzonPrice до прореживания
+    archive_path TEXT, -- parquet файл, если партиция выгружена из базы
+    created_at DATETIME,
+    archived_at DATETIME
+);
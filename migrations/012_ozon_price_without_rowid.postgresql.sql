@@ -0,0 +1,4 @@
+-- в PostgreSQL нет таблиц без rowid, idx_ozon_price_company_offer_date остается для index only scan,
+-- удаляются только индексы, которые не использует ни один запрос и которые замедляют запись цен
+DROP INDEX IF EXISTS idx_ozon_price_item_id;
+DROP INDEX IF EXISTS idx_ozon_price_offer_id;
@@ -0,0 +1,28 @@
+-- OzonPrice хранится по первичному ключу (company_id, offer_id, date) без rowid:
+-- цена за предыдущую дату читается прямо из таблицы, поэтому idx_ozon_price_company_offer_date не нужен,
+-- а idx_ozon_price_item_id и idx_ozon_price_offer_id не используются ни одним запросом.
+-- Каждый лишний индекс замедлял запись цен
+CREATE TABLE OzonPrice_without_rowid
+(
+    company_id TEXT, -- id компании ozon
+    item_id TEXT, -- id товара ozon
+    offer_id TEXT, --  один из id товаров
+    date DATE, -- дата получения цены
+    name TEXT,
+    marketing_seller_price DOUBLE, -- цена продажи
+    old_price DOUBLE, -- зачеркнутая цена на карточке товара
+    marketing_price DOUBLE, -- цена с картой озона
+    marketing_oa_price DOUBLE, -- СПП
+    PRIMARY KEY (company_id, offer_id, date)
+) WITHOUT ROWID;
+
+INSERT INTO OzonPrice_without_rowid
+    (company_id, item_id, offer_id, date, name, marketing_seller_price, old_price, marketing_price, marketing_oa_price)
+SELECT company_id, item_id, offer_id, date, name, marketing_seller_price, old_price, marketing_price, marketing_oa_price
+FROM OzonPrice;
+
+DROP TABLE OzonPrice;
+ALTER TABLE OzonPrice_without_rowid RENAME TO OzonPrice;
+
+CREATE INDEX IF NOT EXISTS idx_ozon_price_date_item_key ON OzonPrice (date, item_id, company_id, offer_id);
+CREATE INDEX IF NOT EXISTS idx_ozon_price_date_company_item_key ON OzonPrice (date, company_id, item_id, offer_id);
@@ -1,27 +1,83 @@
 import asyncio
+import random
+from typing import AsyncIterator
 
+from src.api.rate_limiter import RateLimiter
 from src.browser_request_sender import BrowserRequestSender
+from src.request_sender import RequestError, RequestSender
+from src.config import OZON_API_URL, OZON_MAX_REQUESTS_PER_SECOND, OZON_MIN_REQUESTS_PER_SECOND, OZON_RATE_INCREASE, \
+    OZON_REQUESTS_BURST, OZON_REQUESTS_PER_SECOND, OZON_RETRY_ATTEMPTS, OZON_RETRY_BASE_DELAY_SECONDS, \
+    OZON_RETRY_MAX_DELAY_SECONDS
 from src.dto.item_dto import ItemResponse
 from src.dto.price_dto import PriceResponse
 import logging
 
 logger = logging.getLogger(__name__)
 
+TOO_MANY_REQUESTS = 429
+# 5xx are transient errors of ozon, they are retried but don't reduce the rate
+RETRY_STATUSES = {TOO_MANY_REQUESTS, 500, 502, 503, 504}
+
+def is_retryable(error: RequestError) -> bool:
+    # no status means fetch itself failed in the browser, e.g. a network error
+    return error.status is None or error.status in RETRY_STATUSES
+
 class OzonApi:
-    def __init__(self, request_sender):
-        self.request_sender: BrowserRequestSender = request_sender
+    def __init__(
+        self,
+        request_sender,
+        rate_limiter: RateLimiter | None = None,
+        retry_attempts: int = OZON_RETRY_ATTEMPTS,
+        retry_base_delay: float = OZON_RETRY_BASE_DELAY_SECONDS,
+        retry_max_delay: float = OZON_RETRY_MAX_DELAY_SECONDS,
+        base_url: str = OZON_API_URL
+    ):
+        self.request_sender: RequestSender = request_sender
+        self.base_url = base_url.rstrip('/')
+        self.rate_limiter = rate_limiter or RateLimiter(
+            OZON_REQUESTS_PER_SECOND,
+            OZON_REQUESTS_BURST,
+            min_rate=OZON_MIN_REQUESTS_PER_SECOND,
+            max_rate=OZON_MAX_REQUESTS_PER_SECOND,
+            increase=OZON_RATE_INCREASE
+        )
+        self.retry_attempts = retry_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+
+    async def _send(self, url: str, payload: dict) -> dict:
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire()
+            try:
+                response = await self.request_sender.send_request("POST", url, payload)
+            except RequestError as e:
+                if e.status == TOO_MANY_REQUESTS:
+                    self.rate_limiter.on_throttle(e.retry_after)
+                if not is_retryable(e) or attempt >= self.retry_attempts:
+                    raise
+                # exponential backoff with full jitter, not shorter than Retry-After
+                delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+                if e.retry_after:
+                    delay = max(delay, min(self.retry_max_delay, e.retry_after))
+                attempt += 1
+                logger.warning(f"request to {url} failed with status {e.status}, retry {attempt} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            self.rate_limiter.on_success()
+            return response
 
     async def get_common_prices(self, compandy_id: str, item_ids: list[str]) -> PriceResponse:
-        url = "https://seller.ozon.ru/api/pricing-bff-service/v3/get-common-prices"
+        url = f"{self.base_url}/api/pricing-bff-service/v3/get-common-prices"
         payload = {
             "company_id": compandy_id,
             "item_ids": item_ids
         }
-        response = await self.request_sender.send_request("POST", url, payload)
+        response = await self._send(url, payload)
         logger.debug(response)
         return PriceResponse.model_validate(response)
-    async def list_by_filter(self, company_id: str, search:str = "", limit:int = 50, offset: int = 0) -> ItemResponse:
-        url = "https://seller.ozon.ru/api/v1/products/list-by-filter"
+    async def list_by_filter(self, company_id: str, search:str = "", limit:int = 50, offset: int = 0, cursor: str | None = None) -> ItemResponse:
+        url = f"{self.base_url}/api/v1/products/list-by-filter"
         payload = {
             "company_id": company_id,
             "filters": {
@@ -42,15 +98,36 @@ class OzonApi:
             "visibility": "ALL",
             "sort_by": "SORT_BY_CREATED_AT",
             "sort_dir": "SORT_DIRECTION_DESC",
-            "limit": limit,
-            "offset": offset
+            "limit": limit
         }
-        response = await self.request_sender.send_request("POST", url, payload)
+        if cursor:
+            payload["cursor"] = cursor
+        else:
+            payload["offset"] = offset
+        response = await self._send(url, payload)
         logger.debug(response)
         return ItemResponse.model_validate(response)
 
+    async def iter_products(
+        self, company_id: str, limit: int = 50, offset: int = 0, cursor: str | None = None
+    ) -> AsyncIterator[ItemResponse]:
+        """
+        Pages of products following the cursor returned with each page.
+        Stops when total_items products are listed, so no empty page is requested at the end.
+        offset is only used for the first page when there is no cursor
+        """
+        while True:
+            products_response = await self.list_by_filter(company_id, limit=limit, offset=offset, cursor=cursor)
+            if not products_response.products:
+                return
+            yield products_response
+            offset += len(products_response.products)
+            cursor = products_response.cursor
+            if offset >= products_response.total_items or not cursor:
+                return
+
     async def open_browser(self):
-        await self.request_sender.init()
+        await self.request_sender.ensure_ready()
 
     async def close_browser(self):
         await self.request_sender.close()
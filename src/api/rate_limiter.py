@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all requests to Ozon: allows `rate` requests per second
+    with bursts of up to `burst` requests.
+    The rate is adapted AIMD-style: it grows by `increase` after every successful request
+    and is multiplied by `decrease_factor` when Ozon throttles us, at most once per `decrease_interval` seconds
+    because the requests already in flight are throttled by the same overload
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int = 1,
+        min_rate: float | None = None,
+        max_rate: float | None = None,
+        increase: float = 0.0,
+        decrease_factor: float = 0.5,
+        decrease_interval: float = 1.0
+    ):
+        self.rate = rate
+        self.min_rate = min_rate or rate
+        self.max_rate = max_rate or rate
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.decrease_interval = decrease_interval
+        self.decreased_at: float | None = None
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def on_success(self):
+        if self.rate < self.max_rate:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after: float | None = None):
+        self._refill()
+        # stop the burst that caused throttling, with Retry-After nothing is sent until it passes
+        self.tokens = min(self.tokens, -(retry_after or 0.0) * self.rate)
+        now = time.monotonic()
+        if self.decreased_at is not None and now - self.decreased_at < self.decrease_interval:
+            return
+        self.decreased_at = now
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        logger.warning(f"throttled by ozon, rate is reduced to {self.rate:.2f} requests per second")
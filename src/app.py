@@ -2,26 +2,30 @@ from contextlib import asynccontextmanager
 from logging import getLevelNamesMapping
 
 from fastapi import FastAPI, Request, Form, Query
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from datetime import date, timedelta
+from urllib.parse import urlencode
 import os
 import json
 
 from src.api.ozon_api import OzonApi
-from src.config import LOG_LEVEL
-from src.models.database import session_maker
-from src.persistence.ozon_price_db import get_previous_day
+from src.config import LOG_LEVEL, REQUEST_TRANSPORT
+from src.models.database import dispose_engines, read_session_maker
 from src.persistence.parameters_db import add_scheduled_time, delete_scheduled_time, get_company_ids, add_company_ids, \
     delete_company_id, \
     get_cookies, \
     get_report_path, get_scheduled_times, save_report_path, upsert_cookies
+from src.persistence.price_change_db import CHANGE_FILTERS, DELTA, PCT, PRICE_COLUMNS
+from src.persistence.query_plan import check_query_plans
 from src.persistence.task_db import count_tasks, get_tasks
 from src.browser_request_sender import BrowserRequestSender
+from src.http_request_sender import HttpRequestSender
 import uvicorn
 import logging.handlers
 import sys
 
+from src.service.export_service import iter_csv
 from src.service.ozon_service import OzonService
 from src.service.scheduler_service import ScedulerService
 
@@ -66,10 +70,23 @@ async def lifespan(app: FastAPI):
     logger.info("VERSION 1.2.0")
     from src.models.database import setup_migrations
     await setup_migrations()
+    try:
+        await check_query_plans()
+    except Exception:
+        logger.exception("failed to check query plans")
     
+    service = await get_service()
+    try:
+        await service.open_browser()
+    except Exception:
+        logger.exception("failed to start browser, it will be started on the next run")
+
     scheduler_service = await get_scheduler_service()
     await scheduler_service.restart_scheduler()
     yield
+    await service.close_browser()
+    service.close_report_pool()
+    await dispose_engines()
 app = FastAPI(lifespan=lifespan)
 templates = Jinja2Templates(directory="templates")
 
@@ -81,6 +98,8 @@ async def get_service():
     global sender, api, service
     if sender is None:
         sender = BrowserRequestSender("https://seller.ozon.ru/app/reviews")
+        if REQUEST_TRANSPORT == "http":
+            sender = HttpRequestSender(sender)
         api = OzonApi(sender)
         service = OzonService(api)
     return service
@@ -107,7 +126,14 @@ async def get_prices(
     page: int = Query(1, ge=1),
     company_id: str = Query(None),
     offer_id: str = Query(None),
-    target_date: str = Query(None)
+    target_date: str = Query(None),
+    compare: str = Query("previous_date"),
+    cursor: str = Query(None),
+    field: str = Query("ozon_card"),
+    sort: str = Query(None),
+    order: str = Query("desc"),
+    min_pct: str = Query(None),
+    changes: str = Query(None)
 ):
     service = await get_service()
     
@@ -115,16 +141,30 @@ async def get_prices(
         target_date_obj = date.fromisoformat(target_date) if target_date else date.today()
     except ValueError:
         target_date_obj = date.today()
+    # unknown values and empty form fields mean no sorting or filter
+    field = field if field in PRICE_COLUMNS else "ozon_card"
+    sort = sort if sort in (PCT, DELTA) else None
+    changes = changes if changes in CHANGE_FILTERS else None
+    try:
+        min_pct_value = abs(float(min_pct)) if min_pct else None
+    except ValueError:
+        min_pct_value = None
 
-    previous_date = (await get_previous_day(target_date_obj)) or (target_date_obj - timedelta(days=1))
     price_change_response = await service.get_price_change(
         target_date=target_date_obj,
-        previous_date=previous_date,
         limit=ITEMS_PER_PAGE,
-        offset=(page - 1) * ITEMS_PER_PAGE,
         company_id=company_id,
-        offer_id=offer_id
+        offer_id=offer_id,
+        last_known=compare == "last_known",
+        cursor=cursor,
+        field=field,
+        sort=sort,
+        # the order only applies to a sort, unsorted pages are in the item order of every path
+        descending=sort is not None and order == "desc",
+        min_pct=min_pct_value,
+        changes=changes
     )
+    previous_date = price_change_response.previous_date
 
     total_count = price_change_response.total
     total_pages = (total_count + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
@@ -136,14 +176,49 @@ async def get_prices(
             "prices": price_change_response.price_changes,
             "current_page": page,
             "total_pages": total_pages,
+            "next_cursor": price_change_response.next_cursor,
+            "prev_cursor": price_change_response.prev_cursor,
+            "filters_query": urlencode({
+                key: value for key, value in {
+                    "company_id": company_id,
+                    "offer_id": offer_id,
+                    "compare": compare,
+                    "target_date": target_date_obj.isoformat(),
+                    "field": field,
+                    "sort": sort,
+                    "order": order if sort else None,
+                    "min_pct": min_pct_value,
+                    "changes": changes
+                }.items() if value is not None and value != ""
+            }),
             "company_id": company_id,
             "offer_id": offer_id,
             "target_date": target_date_obj.isoformat(),
-            "previous_date": previous_date.strftime("%Y-%m-%d"),
+            "previous_date": "Last known" if compare == "last_known" else previous_date.strftime("%Y-%m-%d"),
+            "compare": compare,
             "format_percentage": lambda value: f"{value:.4f}"
         }
     )
 
+@app.get("/export/prices.csv")
+async def export_prices_csv(
+    date_from: str = Query(None),
+    date_to: str = Query(None),
+    company_id: str = Query(None),
+    offer_id: str = Query(None)
+):
+    try:
+        date_from_obj = date.fromisoformat(date_from) if date_from else date.today()
+        date_to_obj = date.fromisoformat(date_to) if date_to else date_from_obj
+    except ValueError:
+        date_from_obj = date_to_obj = date.today()
+    filename = f"prices_{date_from_obj.isoformat()}_{date_to_obj.isoformat()}.csv"
+    return StreamingResponse(
+        iter_csv(date_from_obj, date_to_obj, company_id or None, offer_id or None),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @app.get("/settings", response_class=HTMLResponse)
 async def settings(request: Request):
     company_ids = await get_company_ids()
@@ -153,9 +228,9 @@ async def settings(request: Request):
     return templates.TemplateResponse("settings.html", {
         "request": request,
         "company_ids": company_ids,
-        "cookies": cookies.value if cookies else "",
+        "cookies": cookies or "",
         "scheduled_times": scheduled_times,
-        "report_path": report_path.value if report_path else ""
+        "report_path": report_path or ""
     })
 
 @app.post("/company_ids", response_class=HTMLResponse)
@@ -201,14 +276,14 @@ async def update_cookies(request: Request, cookies: str = Form(...)):
         current_cookies = await get_cookies()
         return templates.TemplateResponse("partials/cookies.html", {
             "request": request,
-            "cookies": current_cookies.value if current_cookies else "",
+            "cookies": current_cookies or "",
             "saved": True
         })
     except Exception as e:
         current_cookies = await get_cookies()
         return templates.TemplateResponse("partials/cookies.html", {
             "request": request,
-            "cookies": current_cookies.value if current_cookies else "",
+            "cookies": current_cookies or "",
             "saved": False,
             "error": f"Error saving cookies: {str(e)}"
         })
@@ -249,7 +324,7 @@ async def show_report_path(request: Request):
     report_path = await get_report_path()
     return templates.TemplateResponse("partials/report_path.html", {
         "request": request,
-        "report_path": report_path.value if report_path else "",
+        "report_path": report_path or "",
         "saved": False,
         "error": None
     })
@@ -295,14 +370,15 @@ async def get_tasks_page(request: Request):
 async def get_tasks_endpoint(
     request: Request,
     page: int = Query(1, ge=1),
+    cursor: str = Query(None)
 ):
-    async with session_maker() as session:
+    async with read_session_maker() as session:
         # Get total count
         total_count = await count_tasks(session)
         total_pages = (total_count + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
 
-        # Get paginated tasks
-        tasks = await get_tasks(session, limit=ITEMS_PER_PAGE, offset=(page - 1) * ITEMS_PER_PAGE)
+        # Get the page after or before the cursor
+        tasks, next_cursor, prev_cursor = await get_tasks(session, limit=ITEMS_PER_PAGE, cursor=cursor)
 
     return templates.TemplateResponse(
         "partials/task.html",
@@ -311,5 +387,7 @@ async def get_tasks_endpoint(
             "tasks": tasks,
             "current_page": page,
             "total_pages": total_pages,
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor,
         }
     )
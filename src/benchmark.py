@@ -0,0 +1,142 @@
+import argparse
+import asyncio
+import logging
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+from src.request_sender import RequestSender
+
+class TimingRequestSender(RequestSender):
+    """
+    Records latency of every request sent through the wrapped sender
+    """
+
+    def __init__(self, sender: RequestSender):
+        self.sender = sender
+        self.latencies: list[float] = []
+
+    async def ensure_ready(self):
+        await self.sender.ensure_ready()
+
+    async def close(self):
+        await self.sender.close()
+
+    async def send_request(self, method: str, url: str, payload: dict) -> dict:
+        started = time.perf_counter()
+        try:
+            return await self.sender.send_request(method, url, payload)
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on mac os
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+def percentile(values: list[float], percent: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100)[percent - 1]
+
+async def run(args):
+    # imported here because the database url has to be set before src.config is loaded
+    from src.api.ozon_api import OzonApi
+    from src.api.rate_limiter import RateLimiter
+    from src.http_request_sender import HttpRequestSender
+    from src.mock.ozon_server import start_server, state_from_arguments
+    from src.models.database import engine, setup_migrations
+    from src.service.ozon_service import OzonService
+
+    await setup_migrations()
+    state = state_from_arguments(args)
+    runner, base_url = await start_server(state)
+    sender = TimingRequestSender(HttpRequestSender(None, pool_size=args.pool_size))
+    rate_limiter = RateLimiter(args.rate, burst=max(1, int(args.rate)), min_rate=1, max_rate=args.rate * 2, increase=0.1)
+    api = OzonApi(sender, rate_limiter, retry_base_delay=0.05, base_url=base_url)
+    service = OzonService(api, price_batch_size=args.batch_size, list_page_size=args.page_size)
+
+    db_times: list[float] = []
+    save = service.save_price_rows
+
+    async def timed_save(rows, checkpoint):
+        started = time.perf_counter()
+        await save(rows, checkpoint)
+        db_times.append(time.perf_counter() - started)
+
+    service.save_price_rows = timed_save
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def collect(company_id: str):
+        async with semaphore:
+            await service.get_ozon_prices(args.date, company_id)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(collect(f"bench{i}") for i in range(1, args.companies + 1)))
+    finally:
+        elapsed = time.perf_counter() - started
+        await sender.close()
+        await runner.cleanup()
+        await engine.dispose()
+
+    skus = args.companies * args.catalogue_size
+    db_time = sum(db_times)
+    print(f"companies: {args.companies}, products: {skus}, concurrency: {args.concurrency}")
+    print(f"elapsed: {elapsed:.2f} s, {skus / elapsed:.0f} SKUs/sec")
+    print(
+        f"requests: {len(sender.latencies)}, latency p50 {percentile(sender.latencies, 50) * 1000:.1f} ms, "
+        f"p99 {percentile(sender.latencies, 99) * 1000:.1f} ms, throttled {state.throttled}, errors {state.errors}"
+    )
+    print(f"db writes: {db_time:.2f} s, {skus / db_time if db_time else 0:.0f} rows/sec")
+    print(f"peak RSS: {peak_rss_mb():.1f} MB")
+
+async def run_ingest(args):
+    """
+    Write rate of the bulk upsert alone, without the api and the pipeline
+    """
+    from src.models.database import engine, setup_migrations
+    from src.persistence.ozon_price_db import PriceRow, save_price_rows
+
+    await setup_migrations()
+    page = args.page_size * args.commit_pages
+    started = time.perf_counter()
+    for start in range(0, args.ingest_rows, page):
+        await save_price_rows([
+            PriceRow(f"bench{i % 4}", f"item{i}", f"offer{i}", f"product {i}", args.date, 100.0 + i % 50, 120.0, 95.0, 90.0)
+            for i in range(start, min(start + page, args.ingest_rows))
+        ])
+    elapsed = time.perf_counter() - started
+    await engine.dispose()
+    print(f"ingest: {args.ingest_rows} rows, {args.commit_pages} pages of {args.page_size} per commit")
+    print(f"elapsed: {elapsed:.2f} s, {args.ingest_rows / elapsed:.0f} rows/sec")
+
+def main():
+    from src.mock.ozon_server import add_arguments
+
+    parser = argparse.ArgumentParser(description="collection throughput against the local mock ozon api")
+    add_arguments(parser)
+    parser.add_argument("--companies", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=2, help="companies collected at the same time")
+    parser.add_argument("--rate", type=float, default=50, help="initial requests per second")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--database-url", help="database to write to, a temporary sqlite file by default")
+    parser.add_argument("--ingest-rows", type=int, default=0, help="only measure the bulk upsert of this many rows")
+    parser.add_argument("--commit-pages", type=int, default=5, help="listing pages committed at once in the ingest run")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    from datetime import date
+    args.date = date.today()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{os.path.join(tmp, 'benchmark.sqlite')}"
+        asyncio.run(run_ingest(args) if args.ingest_rows else run(args))
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,56 @@
-from playwright.async_api import async_playwright
+from playwright.async_api import Error as PlaywrightError, async_playwright
 import json
 import logging
 import asyncio
+import time
 
-from src.config import BROWSER_STARTUP_SLEEP_SECONDS, HEADLESS_BROWSER, SUSPEND_AFTER_BROWSER_STARTUP
+from src.config import BROWSER_PAGES, BROWSER_RECYCLE_MINUTES, BROWSER_RECYCLE_REQUESTS, BROWSER_REQUESTS_PER_PAGE, \
+    BROWSER_STARTUP_SLEEP_SECONDS, HEADLESS_BROWSER, SUSPEND_AFTER_BROWSER_STARTUP
 from src.persistence.parameters_db import get_cookies
+from src.request_sender import AUTH_ERROR_STATUSES, RequestError, RequestSender, parse_retry_after
 
 logger = logging.getLogger(__name__)
 
 def on_console(msg):
     logger.info(f"browser console {msg.text}")
 
-class BrowserRequestSender:
+class BrowserRequestSender(RequestSender):
+    """
+    Long-lived browser session. It is started once and reused by all runs:
+    it is restarted when it is not healthy or after recycle_requests requests / recycle_minutes minutes,
+    cookies are reloaded when a request fails with an auth error
+    """
 
-    def __init__(self, base_url: str):
-        self.page = None
+    def __init__(
+        self,
+        base_url: str,
+        pages_count: int = BROWSER_PAGES,
+        requests_per_page: int = BROWSER_REQUESTS_PER_PAGE,
+        recycle_requests: int = BROWSER_RECYCLE_REQUESTS,
+        recycle_minutes: float = BROWSER_RECYCLE_MINUTES
+    ):
+        self.pages = []
+        # page -> requests in flight on it
+        self.page_load: dict = {}
+        self.pages_count = max(1, pages_count)
+        self.requests_per_page = max(1, requests_per_page)
         self.pw = None
         self.browser = None
         self.base_url = base_url
         self.context = None
+        self.recycle_requests = recycle_requests
+        self.recycle_minutes = recycle_minutes
+        self.started_at: float | None = None
+        self.requests_count = 0
+        self.generation = 0
+        # a request failed in playwright, the pages are checked before the next one
+        self._failed = False
+        self._in_flight = 0
+        self._lock = asyncio.Lock()
+        self._ready = asyncio.Event()
+        self._ready.set()
+        self._page_released = asyncio.Condition()
+
     async def init(self) -> "BrowserRequestSender":
         self.pw = await async_playwright().start()
         self.browser = await self.pw.chromium.launch(
@@ -30,6 +62,23 @@ class BrowserRequestSender:
         )
         context = await self.browser.new_context()
         self.context = context
+        await context.add_cookies(await self._load_cookies())
+        for _ in range(self.pages_count):
+            page = await context.new_page()
+            page.on('console', on_console)
+            self.pages.append(page)
+        # fetch is sent from the page, so every page has to be on the seller origin
+        await asyncio.gather(*(page.goto(self.base_url) for page in self.pages))
+        self.page_load = {page: 0 for page in self.pages}
+        await asyncio.sleep(BROWSER_STARTUP_SLEEP_SECONDS)
+        if SUSPEND_AFTER_BROWSER_STARTUP:
+            input("suspend after browser startup. Enter anything to continue")
+        self.started_at = time.monotonic()
+        self.requests_count = 0
+        self.generation += 1
+        return self
+
+    async def _load_cookies(self) -> list[dict]:
         converter = {
             "sameSite": lambda v: 'Strict' if v.lower().strip() == 'strict' else 'Lax' if v.lower().strip() == 'lax' else 'None',
             "partitionKey": lambda x: ""
@@ -37,27 +86,134 @@ class BrowserRequestSender:
         cookies = await get_cookies()
         if not cookies:
             raise Exception("set cookies")
-        cookies = json.loads(cookies.value)
-        cookies = [{k: converter.get(k, lambda x: x)(v) for k, v in cookie.items()} for cookie in cookies]
-        await context.add_cookies(cookies)
-        self.page = await context.new_page()
-
-        self.page.on('console', on_console)
-        await self.page.goto(self.base_url)
-        await asyncio.sleep(BROWSER_STARTUP_SLEEP_SECONDS)
-        if SUSPEND_AFTER_BROWSER_STARTUP:
-            input("suspend after browser startup. Enter anything to continue")
-        return self
+        cookies = json.loads(cookies)
+        return [{k: converter.get(k, lambda x: x)(v) for k, v in cookie.items()} for cookie in cookies]
 
     async def close(self):
-        if self.page:
-            await self.page.close()
+        for page in self.pages:
+            await page.close()
+        self.pages = []
+        self.page_load = {}
         if self.context:
             await self.context.close()
         if self.browser:
             await self.browser.close()
         if self.pw:
             await self.pw.stop()
+        self.context = None
+        self.browser = None
+        self.pw = None
+        self.started_at = None
+
+    async def get_session(self) -> tuple[list[dict], str]:
+        """
+        Cookies and user agent of the browser session, used to send requests without the browser
+        """
+        await self.ensure_ready()
+        cookies = await self.context.cookies()
+        user_agent = await self.pages[0].evaluate("() => navigator.userAgent")
+        return cookies, user_agent
+
+    @property
+    def is_started(self) -> bool:
+        return self.browser is not None and self.browser.is_connected()
+
+    def _should_recycle(self) -> bool:
+        if self.recycle_requests and self.requests_count >= self.recycle_requests:
+            return True
+        if self.recycle_minutes and self.started_at is not None:
+            return time.monotonic() - self.started_at >= self.recycle_minutes * 60
+        return False
+
+    async def ensure_ready(self):
+        """
+        Start the browser if it is not started yet and restart it if the pages do not respond
+        """
+        async with self._lock:
+            if self.is_started and await self._is_healthy():
+                return
+            await self._restart("browser is not started or not healthy")
+
+    async def _is_healthy(self) -> bool:
+        try:
+            for page in self.pages:
+                await page.evaluate("() => document.readyState")
+            return bool(self.pages)
+        except Exception:
+            logger.exception("browser health check failed")
+            return False
+
+    async def _wait_idle(self):
+        self._ready.clear()
+        while self._in_flight:
+            await asyncio.sleep(0.1)
+
+    async def _restart(self, reason: str):
+        logger.info(f"restarting browser: {reason}")
+        await self._wait_idle()
+        try:
+            await self.close()
+            await self.init()
+        finally:
+            await self._set_ready()
+
+    async def _reauthenticate(self, generation: int):
+        async with self._lock:
+            if generation != self.generation:
+                # cookies were already reloaded by another request
+                return
+            logger.warning("auth error, reloading cookies")
+            await self._wait_idle()
+            try:
+                await self.context.clear_cookies()
+                await self.context.add_cookies(await self._load_cookies())
+                await asyncio.gather(*(page.reload() for page in self.pages))
+                self.generation += 1
+            finally:
+                await self._set_ready()
+
+    async def _before_request(self):
+        if self.is_started and not self._failed and not self._should_recycle():
+            return
+        async with self._lock:
+            if not self.is_started:
+                await self._restart("browser is not started")
+            elif self._failed:
+                self._failed = False
+                if not await self._is_healthy():
+                    await self._restart("pages do not respond after a failed request")
+            elif self._should_recycle():
+                await self._restart(f"recycling after {self.requests_count} requests")
+
+    async def _set_ready(self):
+        self._ready.set()
+        async with self._page_released:
+            self._page_released.notify_all()
+
+    async def _acquire_page(self):
+        """
+        Least busy page of the pool. Several requests can run on one page at the same time,
+        up to requests_per_page
+        """
+        while True:
+            await self._ready.wait()
+            if not self.page_load:
+                raise RequestError("browser is not started")
+            async with self._page_released:
+                page = min(self.page_load, key=self.page_load.get)
+                if self._ready.is_set() and self.page_load[page] < self.requests_per_page:
+                    self.page_load[page] += 1
+                    self._in_flight += 1
+                    return page
+                # all pages are busy or the browser is being restarted
+                await self._page_released.wait()
+
+    async def _release_page(self, page):
+        async with self._page_released:
+            if page in self.page_load:
+                self.page_load[page] -= 1
+            self._in_flight -= 1
+            self._page_released.notify()
 
     async def send_request(self, method: str, url: str, payload: dict) -> dict:
         request_data = {
@@ -65,7 +221,35 @@ class BrowserRequestSender:
             'url': url,
             'body': payload
         }
-        response = await self.page.evaluate(
+        for attempt in range(2):
+            await self._before_request()
+            generation = self.generation
+            page = await self._acquire_page()
+            try:
+                response = await self._evaluate(page, request_data)
+            except PlaywrightError as e:
+                # a closed page, an interrupted navigation or a timeout, no status so OzonApi retries it
+                self._failed = True
+                raise RequestError(f"browser request failed: {e}")
+            finally:
+                await self._release_page(page)
+            self.requests_count += 1
+
+            if response and 'error' in response:
+                status = response.get('status')
+                if status in AUTH_ERROR_STATUSES and attempt == 0:
+                    try:
+                        await self._reauthenticate(generation)
+                    except PlaywrightError as e:
+                        self._failed = True
+                        raise RequestError(f"reloading cookies failed: {e}")
+                    continue
+                raise RequestError(response.get('error'), status, parse_retry_after(response.get('retryAfter')))
+
+            return response
+
+    async def _evaluate(self, page, request_data: dict) -> dict:
+        return await page.evaluate(
             #language=js
             """async (data) => {
                 try {
@@ -76,7 +260,7 @@ class BrowserRequestSender:
 
                     if (!response.ok) {
                         const error = await response.text();
-                        return { error: error, status: response.status };
+                        return { error: error, status: response.status, retryAfter: response.headers.get('Retry-After') };
                     }
                     return await response.json();
                 } catch (error) {
@@ -84,11 +268,6 @@ class BrowserRequestSender:
                 }
             }""", request_data)
 
-        if response and 'error' in response:
-            raise Exception(response.get('error'))
-
-        return response
-
 async def main():
     payload = {
         "company_id": "836045",
@@ -11,5 +11,44 @@ try:
         HEADLESS_BROWSER = config.get("HEADLESS_BROWSER", True)
         BROWSER_STARTUP_SLEEP_SECONDS = config.get("BROWSER_STARTUP_SLEEP_SECONDS", 5)
         SUSPEND_AFTER_BROWSER_STARTUP = config.get("SUSPEND_AFTER_BROWSER_STARTUP", False)
+        # environment variable wins so that tools like the benchmark can use their own database
+        DATABASE_URL = os.environ.get("DATABASE_URL", config.get("DATABASE_URL", "sqlite+aiosqlite:///./PriceMonitor.sqlite"))
+        OZON_API_URL = config.get("OZON_API_URL", "https://seller.ozon.ru")
+        COLLECTION_CONCURRENCY = config.get("COLLECTION_CONCURRENCY", 4)
+        BROWSER_PAGES = config.get("BROWSER_PAGES", 4)
+        BROWSER_REQUESTS_PER_PAGE = config.get("BROWSER_REQUESTS_PER_PAGE", 2)
+        BROWSER_RECYCLE_REQUESTS = config.get("BROWSER_RECYCLE_REQUESTS", 2000)
+        BROWSER_RECYCLE_MINUTES = config.get("BROWSER_RECYCLE_MINUTES", 120)
+        OZON_REQUESTS_PER_SECOND = config.get("OZON_REQUESTS_PER_SECOND", 4)
+        OZON_REQUESTS_BURST = config.get("OZON_REQUESTS_BURST", 4)
+        OZON_MIN_REQUESTS_PER_SECOND = config.get("OZON_MIN_REQUESTS_PER_SECOND", 0.5)
+        OZON_MAX_REQUESTS_PER_SECOND = config.get("OZON_MAX_REQUESTS_PER_SECOND", 10)
+        OZON_RATE_INCREASE = config.get("OZON_RATE_INCREASE", 0.1)
+        OZON_RETRY_ATTEMPTS = config.get("OZON_RETRY_ATTEMPTS", 5)
+        OZON_RETRY_BASE_DELAY_SECONDS = config.get("OZON_RETRY_BASE_DELAY_SECONDS", 1)
+        OZON_RETRY_MAX_DELAY_SECONDS = config.get("OZON_RETRY_MAX_DELAY_SECONDS", 30)
+        PIPELINE_QUEUE_SIZE = config.get("PIPELINE_QUEUE_SIZE", 2)
+        LIST_PAGE_SIZE = config.get("LIST_PAGE_SIZE", 100)
+        PRICE_BATCH_SIZE = config.get("PRICE_BATCH_SIZE", 200)
+        REQUEST_TRANSPORT = config.get("REQUEST_TRANSPORT", "browser")
+        HTTP_POOL_SIZE = config.get("HTTP_POOL_SIZE", 10)
+        HTTP_TIMEOUT_SECONDS = config.get("HTTP_TIMEOUT_SECONDS", 30)
+        REPORT_MAX_CONCURRENT_JOBS = config.get("REPORT_MAX_CONCURRENT_JOBS", 2)
+        REPORT_PROCESS_THRESHOLD_ROWS = config.get("REPORT_PROCESS_THRESHOLD_ROWS", 20000)
+        REPORT_QUEUE_SIZE = config.get("REPORT_QUEUE_SIZE", 8)
+        REPORT_MODE = config.get("REPORT_MODE", "company")
+        STORAGE_MODE = config.get("STORAGE_MODE", "full")
+        DATABASE_READ_POOL_SIZE = config.get("DATABASE_READ_POOL_SIZE", 4)
+        SQLITE_JOURNAL_MODE = config.get("SQLITE_JOURNAL_MODE", "WAL")
+        SQLITE_SYNCHRONOUS = config.get("SQLITE_SYNCHRONOUS", "NORMAL")
+        SQLITE_CACHE_SIZE_MB = config.get("SQLITE_CACHE_SIZE_MB", 64)
+        SQLITE_MMAP_SIZE_MB = config.get("SQLITE_MMAP_SIZE_MB", 256)
+        SQLITE_BUSY_TIMEOUT_MS = config.get("SQLITE_BUSY_TIMEOUT_MS", 5000)
+        INGEST_CHUNK_ROWS = config.get("INGEST_CHUNK_ROWS", 5000)
+        INGEST_COMMIT_PAGES = config.get("INGEST_COMMIT_PAGES", 5)
+        PRICE_RETENTION_DAYS = config.get("PRICE_RETENTION_DAYS", 0)
+        PRICE_ARCHIVE_AFTER_DAYS = config.get("PRICE_ARCHIVE_AFTER_DAYS", 0)
+        PRICE_ARCHIVE_DIR = config.get("PRICE_ARCHIVE_DIR", "archive")
+        PARAMETER_CACHE_TTL_SECONDS = config.get("PARAMETER_CACHE_TTL_SECONDS", 0)
 except Exception:
     logger.exception("failed to load config file")
@@ -4,8 +4,11 @@ from pydantic import BaseModel
 
 class PriceChange(BaseModel):
     date: date
+    # date of the compared previous price, None when there is no previous price
+    previous_date: date | None = None
     company_id: str
     offer_id: str
+    item_id: str | None = None
     name: str
     today_seller_price: float | None
     today_spp: float | None
@@ -16,4 +19,7 @@ class PriceChange(BaseModel):
 
 class PriceChangeResponse(BaseModel):
     price_changes: list[PriceChange]
-    total: int
\ No newline at end of file
+    total: int
+    previous_date: date | None = None
+    next_cursor: str | None = None
+    prev_cursor: str | None = None
\ No newline at end of file
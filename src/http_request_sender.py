@@ -0,0 +1,102 @@
+import asyncio
+import json
+import logging
+from urllib.parse import urlparse
+
+import aiohttp
+
+from src.browser_request_sender import BrowserRequestSender
+from src.config import HTTP_POOL_SIZE, HTTP_TIMEOUT_SECONDS
+from src.request_sender import AUTH_ERROR_STATUSES, RequestError, RequestSender, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+class HttpRequestSender(RequestSender):
+    """
+    Sends requests with aiohttp using cookies and user agent of the browser session.
+    The browser is only used to get the session and as a fallback
+    when ozon answers with a challenge page or an auth error.
+    Without a browser plain requests are sent, e.g. to the mock server
+    """
+
+    def __init__(
+        self,
+        browser_sender: BrowserRequestSender | None,
+        pool_size: int = HTTP_POOL_SIZE,
+        timeout_seconds: float = HTTP_TIMEOUT_SECONDS
+    ):
+        self.browser_sender = browser_sender
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=timeout_seconds)
+        self.session: aiohttp.ClientSession | None = None
+        self._lock = asyncio.Lock()
+
+    async def ensure_ready(self):
+        async with self._lock:
+            if self.session is None:
+                await self._open_session()
+
+    async def _open_session(self):
+        headers = {
+            'Accept': 'application/json, text/plain, */*',
+            # the same content type as fetch with a string body in the browser
+            'Content-Type': 'text/plain;charset=UTF-8'
+        }
+        cookies = []
+        if self.browser_sender:
+            cookies, user_agent = await self.browser_sender.get_session()
+            origin = urlparse(self.browser_sender.base_url)
+            host = origin.hostname
+            headers.update({
+                'User-Agent': user_agent,
+                'Cookie': "; ".join(
+                    f"{cookie['name']}={cookie['value']}" for cookie in cookies
+                    if host.endswith(cookie.get('domain', host).lstrip('.'))
+                ),
+                'Origin': f"{origin.scheme}://{origin.netloc}",
+                'Referer': self.browser_sender.base_url
+            })
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+                cookie_jar=aiohttp.DummyCookieJar(),
+                timeout=self.timeout
+            )
+        # headers are updated in place so that requests in flight keep their connections
+        self.session.headers.update(headers)
+        logger.info(f"http session is opened with {len(cookies)} cookies")
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+        if self.browser_sender:
+            await self.browser_sender.close()
+
+    async def _fallback(self, method: str, url: str, payload: dict, reason: str) -> dict:
+        logger.warning(f"{reason}, sending request through the browser")
+        response = await self.browser_sender.send_request(method, url, payload)
+        # the browser passed the challenge or reloaded cookies, take the new session
+        async with self._lock:
+            await self._open_session()
+        return response
+
+    async def send_request(self, method: str, url: str, payload: dict) -> dict:
+        await self.ensure_ready()
+        try:
+            async with self.session.request(method, url, data=json.dumps(payload)) as response:
+                content_type = response.headers.get('Content-Type', '')
+                challenge = response.status in AUTH_ERROR_STATUSES or content_type.startswith('text/html')
+                if not (challenge and self.browser_sender):
+                    if response.status >= 400:
+                        raise RequestError(
+                            await response.text(), response.status, parse_retry_after(response.headers.get('Retry-After'))
+                        )
+                    return await response.json(content_type=None)
+        except aiohttp.ClientError as e:
+            raise RequestError(str(e))
+        except asyncio.TimeoutError:
+            # no status, OzonApi retries it like a network error
+            raise RequestError(f"no response in {self.timeout.total}s")
+        # the connection is back in the pool while the browser sends the request
+        return await self._fallback(method, url, payload, f"got {response.status} {content_type}")
@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import zlib
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+class MockOzonState:
+    """
+    Settings and counters of the mock seller api
+    """
+
+    def __init__(
+        self,
+        catalogue_size: int = 10_000,
+        latency_ms: float = 50,
+        latency_jitter_ms: float = 20,
+        error_rate: float = 0.0,
+        rate_limit: float = 0.0,
+        max_item_ids: int = 1000
+    ):
+        self.catalogue_size = catalogue_size
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        # requests per second served before answering 429, 0 - no throttling
+        self.rate_limit = rate_limit
+        self.max_item_ids = max_item_ids
+        self.tokens = max(1.0, rate_limit)
+        self.updated_at = time.monotonic()
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+
+    def throttle(self) -> bool:
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        self.tokens = min(self.rate_limit, self.tokens + (now - self.updated_at) * self.rate_limit)
+        self.updated_at = now
+        if self.tokens < 1:
+            self.throttled += 1
+            return True
+        self.tokens -= 1
+        return False
+
+def item_id(company_id: str, index: int) -> str:
+    return f"{company_id}{index:09d}"
+
+def price_of(item: str) -> float:
+    # stable pseudo random price of the item
+    return float(100 + zlib.crc32(item.encode()) % 10_000)
+
+async def _simulate(request: web.Request) -> tuple[MockOzonState, dict] | web.Response:
+    state: MockOzonState = request.app['state']
+    state.requests += 1
+    body = json.loads(await request.text())
+    delay = state.latency_ms + random.uniform(-state.latency_jitter_ms, state.latency_jitter_ms)
+    await asyncio.sleep(max(0.0, delay) / 1000)
+    if state.throttle():
+        return web.Response(status=429, text="too many requests")
+    if state.error_rate and random.random() < state.error_rate:
+        state.errors += 1
+        return web.Response(status=503, text="service unavailable")
+    return state, body
+
+async def list_by_filter(request: web.Request) -> web.Response:
+    result = await _simulate(request)
+    if isinstance(result, web.Response):
+        return result
+    state, body = result
+    company_id = body["company_id"]
+    offset = int(body.get("cursor") or body.get("offset") or 0)
+    end = min(state.catalogue_size, offset + body.get("limit", 50))
+    products = [
+        {
+            "item_id": item_id(company_id, i),
+            "company_id": company_id,
+            "part_item": {"offer_id": f"offer-{i}", "name": f"product {i}"}
+        }
+        for i in range(offset, end)
+    ]
+    return web.json_response({
+        "products": products,
+        "cursor": str(end) if end < state.catalogue_size else "",
+        "total_items": state.catalogue_size,
+        "provider_errors": []
+    })
+
+async def get_common_prices(request: web.Request) -> web.Response:
+    result = await _simulate(request)
+    if isinstance(result, web.Response):
+        return result
+    state, body = result
+    if len(body["item_ids"]) > state.max_item_ids:
+        return web.Response(status=413, text=f"item_ids must contain at most {state.max_item_ids} items")
+    items = []
+    for item in body["item_ids"]:
+        price = price_of(item)
+        items.append({
+            "item_id": item,
+            "currency_code": "RUB",
+            "price": price,
+            "old_price": price * 1.5,
+            "marketing_price": price * 0.9,
+            "marketing_oa_price": price * 0.85,
+            "marketing_seller_price": price
+        })
+    return web.json_response({"items": items, "errors": []})
+
+def create_app(state: MockOzonState) -> web.Application:
+    app = web.Application()
+    app['state'] = state
+    app.router.add_post('/api/v1/products/list-by-filter', list_by_filter)
+    app.router.add_post('/api/pricing-bff-service/v3/get-common-prices', get_common_prices)
+    return app
+
+async def start_server(state: MockOzonState, host: str = "127.0.0.1", port: int = 0) -> tuple[web.AppRunner, str]:
+    """
+    Start the mock server in the current event loop, returns the runner and the base url
+    """
+    runner = web.AppRunner(create_app(state), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--catalogue-size", type=int, default=10_000, help="products per company")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--latency-jitter-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests per second before 429, 0 - unlimited")
+    parser.add_argument("--max-item-ids", type=int, default=1000, help="larger price requests are rejected with 413")
+
+def state_from_arguments(args) -> MockOzonState:
+    return MockOzonState(
+        catalogue_size=args.catalogue_size,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        max_item_ids=args.max_item_ids
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="local stand-in for the ozon seller api")
+    add_arguments(parser)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    web.run_app(create_app(state_from_arguments(args)), host=args.host, port=args.port)
+
+if __name__ == '__main__':
+    main()
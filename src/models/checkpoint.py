@@ -0,0 +1,17 @@
+from sqlalchemy import Column, String, Integer, Date, DateTime, Boolean
+from sqlalchemy.ext.declarative import declarative_base
+from datetime import datetime
+
+Base = declarative_base()
+
+class CollectionCheckpoint(Base):
+    __tablename__ = "CollectionCheckpoint"
+
+    company_id = Column(String, primary_key=True)
+    date = Column(Date, primary_key=True)
+    next_offset = Column(Integer, default=0)
+    cursor = Column(String)
+    pages_done = Column(Integer, default=0)
+    items_saved = Column(Integer, default=0)
+    finished = Column(Boolean, default=False)
+    updated_at = Column(DateTime, default=lambda: datetime.now(), onupdate=lambda: datetime.now())
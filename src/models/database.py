@@ -1,19 +1,66 @@
 import os
 import re
 from datetime import datetime
-from sqlalchemy import text
+from sqlalchemy import event, inspect, make_url, text
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 
-# Database configuration
-DATABASE_URL = "sqlite+aiosqlite:///./PriceMonitor.sqlite"
+from src.config import DATABASE_URL, DATABASE_READ_POOL_SIZE, SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_SIZE_MB, \
+    SQLITE_JOURNAL_MODE, SQLITE_MMAP_SIZE_MB, SQLITE_SYNCHRONOUS
 
-# Create async engine
-engine = create_async_engine(DATABASE_URL, echo=False)
+POSTGRESQL = "postgresql"
+SQLITE = "sqlite"
+# the upserts and migrations are written for these dialects only
+DIALECTS = (SQLITE, POSTGRESQL)
+
+def sqlite_pragmas(read_only: bool = False) -> list[str]:
+    pragmas = [
+        f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        # negative cache size is in KiB
+        f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_MB * 1024}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE_MB * 1024 * 1024}",
+        "PRAGMA temp_store=MEMORY",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+    ]
+    if read_only:
+        pragmas.append("PRAGMA query_only=ON")
+    return pragmas
+
+def apply_pragmas(engine, pragmas: list[str]):
+    @event.listens_for(engine.sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+backend = make_url(DATABASE_URL).get_backend_name()
+if backend not in DIALECTS:
+    raise RuntimeError(f"{backend} databases are not supported, DATABASE_URL must be one of: {', '.join(DIALECTS)}")
+if backend == SQLITE:
+    # sqlite has a single writer, writes are serialized through one connection instead of waiting for the file lock,
+    # with WAL the read-only connections of the web UI are not blocked by the writer
+    engine = create_async_engine(DATABASE_URL, echo=False, pool_size=1, max_overflow=0, pool_timeout=300)
+    apply_pragmas(engine, sqlite_pragmas())
+    read_engine = create_async_engine(DATABASE_URL, echo=False, pool_size=DATABASE_READ_POOL_SIZE, max_overflow=0)
+    apply_pragmas(read_engine, sqlite_pragmas(read_only=True))
+else:
+    engine = create_async_engine(DATABASE_URL, echo=False)
+    read_engine = engine
 
 # Create async session factory
 session_maker = async_sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
+# sessions of pages, reports and exports, they only read
+read_session_maker = async_sessionmaker(
+    read_engine, class_=AsyncSession, expire_on_commit=False
+)
+
+async def dispose_engines():
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
 
 async def run_migration(conn, filename: str, migration_dir: str):
     """Run a single migration file"""
@@ -32,6 +79,27 @@ async def run_migration(conn, filename: str, migration_dir: str):
     )
     print(f"✅ Applied migration: {filename}")
 
+def migration_files(migration_dir: str, dialect: str) -> list[str]:
+    """
+    Migration files in order. NNN_name.<dialect>.sql replaces NNN_name.sql for its dialect,
+    files of other dialects are skipped. A repeated number or an unknown dialect is an error
+    """
+    generic = {}
+    specific = {}
+    for f in sorted(os.listdir(migration_dir)):
+        if match := re.match(r'^(\d+)_[^.]+(?:\.([^.]+))?\.sql$', f):
+            number, file_dialect = int(match.group(1)), match.group(2)
+            if file_dialect is not None and file_dialect not in DIALECTS:
+                raise ValueError(f"migration {f} is for an unknown dialect {file_dialect}, names can't contain dots")
+            migrations = generic if file_dialect is None else specific.setdefault(file_dialect, {})
+            if number in migrations:
+                raise ValueError(f"migrations {migrations[number]} and {f} have the same number")
+            migrations[number] = f
+        elif f.endswith('.sql'):
+            raise ValueError(f"migration {f} is not named NNN_name.sql or NNN_name.<dialect>.sql")
+    migrations = {**generic, **specific.get(dialect, {})}
+    return [migrations[number] for number in sorted(migrations)]
+
 async def setup_migrations():
     """Setup database by running all pending migrations"""
     migration_dir = "migrations"
@@ -39,24 +107,16 @@ async def setup_migrations():
         return
         
     async with engine.begin() as conn:
-        # Get or create migrations table
-        try:
-            await conn.execute(text("SELECT 1 FROM migrations LIMIT 1"))
-        except:
+        # Get or create migrations table, a failed query would abort the whole transaction in postgresql
+        if not await conn.run_sync(lambda sync_conn: inspect(sync_conn).has_table("migrations")):
             await run_migration(conn, "004_migration_tracker.sql", migration_dir)
         
         # Get applied migrations
         result = await conn.execute(text("SELECT filename FROM migrations"))
         applied = {row[0] for row in result}
         
-        # Find and sort migration files
-        migrations = []
-        for f in os.listdir(migration_dir):
-            if match := re.match(r'^(\d+)_.+\.sql$', f):
-                migrations.append((int(match.group(1)), f))
-        
         # Run migrations in order
-        for num, filename in sorted(migrations, key=lambda x: x[0]):
+        for filename in migration_files(migration_dir, conn.dialect.name):
             if filename not in applied:
                 try:
                     await run_migration(conn, filename, migration_dir)
@@ -7,7 +7,7 @@ class OzonPrice(Base):
     __tablename__ = "OzonPrice"
     
     company_id = Column(String, primary_key=True)
-    item_id = Column(String, index=True)
+    item_id = Column(String)
     offer_id = Column(String, primary_key=True)
     name = Column(String)
     date = Column(Date, primary_key=True)
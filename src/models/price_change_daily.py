@@ -0,0 +1,35 @@
+from sqlalchemy import Column, String, Float, Date, DateTime
+from sqlalchemy.ext.declarative import declarative_base
+from datetime import datetime
+
+Base = declarative_base()
+
+class PriceChangeDaily(Base):
+    __tablename__ = "PriceChangeDaily"
+
+    date = Column(Date, primary_key=True)
+    company_id = Column(String, primary_key=True)
+    offer_id = Column(String, primary_key=True)
+    item_id = Column(String)
+    name = Column(String)
+    previous_date = Column(Date)
+    today_seller_price = Column(Float)
+    today_spp = Column(Float)
+    today_ozon_card = Column(Float)
+    yesterday_seller_price = Column(Float)
+    yesterday_spp = Column(Float)
+    yesterday_ozon_card = Column(Float)
+    delta_seller_price = Column(Float)
+    delta_spp = Column(Float)
+    delta_ozon_card = Column(Float)
+    pct_seller_price = Column(Float)
+    pct_spp = Column(Float)
+    pct_ozon_card = Column(Float)
+    direction = Column(String)
+
+class PriceChangeRefresh(Base):
+    __tablename__ = "PriceChangeRefresh"
+
+    date = Column(Date, primary_key=True)
+    company_id = Column(String, primary_key=True)
+    refreshed_at = Column(DateTime, default=lambda: datetime.now())
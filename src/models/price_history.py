@@ -0,0 +1,54 @@
+from sqlalchemy import Column, String, Float, Date
+from sqlalchemy.ext.declarative import declarative_base
+
+Base = declarative_base()
+
+class LatestPrice(Base):
+    __tablename__ = "LatestPrice"
+
+    company_id = Column(String, primary_key=True)
+    offer_id = Column(String, primary_key=True)
+    item_id = Column(String)
+    name = Column(String)
+    date = Column(Date)
+    valid_from = Column(Date)
+    marketing_seller_price = Column(Float)
+    old_price = Column(Float)
+    marketing_price = Column(Float)
+    marketing_oa_price = Column(Float)
+
+class PriceHistory(Base):
+    __tablename__ = "PriceHistory"
+
+    company_id = Column(String, primary_key=True)
+    offer_id = Column(String, primary_key=True)
+    valid_from = Column(Date, primary_key=True)
+    valid_to = Column(Date)
+    item_id = Column(String)
+    name = Column(String)
+    marketing_seller_price = Column(Float)
+    old_price = Column(Float)
+    marketing_price = Column(Float)
+    marketing_oa_price = Column(Float)
+
+class CollectionDate(Base):
+    __tablename__ = "CollectionDate"
+
+    date = Column(Date, primary_key=True)
+    company_id = Column(String, primary_key=True)
+
+class OzonPriceView(Base):
+    """
+    Read only view with the columns of OzonPrice, used by the price queries in the incremental storage mode
+    """
+    __tablename__ = "OzonPriceView"
+
+    company_id = Column(String, primary_key=True)
+    item_id = Column(String)
+    offer_id = Column(String, primary_key=True)
+    name = Column(String)
+    date = Column(Date, primary_key=True)
+    marketing_seller_price = Column(Float)
+    old_price = Column(Float)
+    marketing_price = Column(Float)
+    marketing_oa_price = Column(Float)
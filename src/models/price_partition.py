@@ -0,0 +1,16 @@
+from sqlalchemy import Column, String, Integer, Date, DateTime
+from sqlalchemy.ext.declarative import declarative_base
+from datetime import datetime
+
+Base = declarative_base()
+
+class PricePartition(Base):
+    __tablename__ = "PricePartition"
+
+    month = Column(Date, primary_key=True)
+    table_name = Column(String)
+    rows = Column(Integer, default=0)
+    source_rows = Column(Integer, default=0)
+    archive_path = Column(String)
+    created_at = Column(DateTime, default=lambda: datetime.now())
+    archived_at = Column(DateTime)
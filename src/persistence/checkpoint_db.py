@@ -0,0 +1,13 @@
+from datetime import date
+
+from src.models.checkpoint import CollectionCheckpoint
+from src.models.database import read_session_maker, session_maker
+
+
+async def get_checkpoint(company_id: str, collection_date: date) -> CollectionCheckpoint | None:
+    async with read_session_maker() as session:
+        return await session.get(CollectionCheckpoint, (company_id, collection_date))
+
+async def save_checkpoint(checkpoint: CollectionCheckpoint):
+    async with session_maker() as session, session.begin():
+        await session.merge(checkpoint)
@@ -0,0 +1,39 @@
+import base64
+import json
+from datetime import datetime
+
+AFTER = "after"
+BEFORE = "before"
+
+def encode_cursor(direction: str, values: list) -> str:
+    """
+    Opaque cursor for keyset pagination: the sort key of the row to continue from and the direction
+    """
+    data = json.dumps({"d": direction, "k": values}, default=str)
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+def decode_value(value, value_type: type):
+    # json has no dates, datetimes are encoded as iso strings
+    if value_type is datetime and isinstance(value, str):
+        return datetime.fromisoformat(value)
+    if value_type is float and isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    if type(value) is not value_type:
+        raise ValueError(f"{value!r} is not {value_type.__name__}")
+    return value
+
+def decode_cursor(cursor: str | None, types: tuple[type, ...]) -> tuple[str, list] | None:
+    """
+    Direction and sort key of the cursor, types are the types of the key values of the caller's keyset
+    """
+    if not cursor:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        direction, values = data["d"], data["k"]
+        if direction not in (AFTER, BEFORE) or not isinstance(values, list) or len(values) != len(types):
+            return None
+        return direction, [decode_value(value, value_type) for value, value_type in zip(values, types)]
+    except Exception:
+        # a broken cursor or a cursor of another keyset starts from the first page
+        return None
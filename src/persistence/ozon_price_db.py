@@ -1,156 +1,471 @@
 import asyncio
 import logging
 from datetime import UTC, date, datetime, timedelta
+from typing import NamedTuple
 
-from sqlalchemy import and_, select, func
-from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy import Date, and_, func, literal, select, true, tuple_, union_all
 from sqlalchemy.orm import aliased
 
-from src.dto.price_change import PriceChange
-from src.models.database import session_maker
+from src.dto.price_change import PriceChange, PriceChangeResponse
+from src.models.checkpoint import CollectionCheckpoint
+from src.models.database import read_session_maker, session_maker
+from src.config import INGEST_CHUNK_ROWS, STORAGE_MODE
 from src.models.ozon_price import OzonPrice
+from src.models.price_history import CollectionDate, OzonPriceView
+from src.persistence.price_history_db import close_missing_prices, save_price_changes
+from src.persistence.partition_db import get_partitions, partition_table
+from src.persistence.keyset import AFTER, BEFORE, decode_cursor, encode_cursor
+from src.persistence.upsert import POSTGRESQL, SQLITE, insert
 
 logger = logging.getLogger(__name__)
 
-async def save_ozon_prices(prices: list[OzonPrice]):
-    if not prices:
-        logger.info("No prices to save")
+FULL = "full"
+INCREMENTAL = "incremental"
+
+# prices are read from the table of full rows or, in the incremental mode, from the view over the intervals
+PriceSource = OzonPriceView if STORAGE_MODE == INCREMENTAL else OzonPrice
+# collected dates, the view would have to join the intervals to find them
+PriceDate = CollectionDate if STORAGE_MODE == INCREMENTAL else OzonPrice
+
+class PriceRow(NamedTuple):
+    """
+    Collected price of a SKU as it is written to OzonPrice, without ORM objects
+    """
+    company_id: str
+    item_id: str
+    offer_id: str
+    name: str
+    date: date
+    marketing_seller_price: float | None
+    old_price: float | None
+    marketing_price: float | None
+    marketing_oa_price: float | None
+
+PRICE_ROW_COLUMNS = ', '.join(PriceRow._fields)
+ON_PRICE_CONFLICT = """
+ON CONFLICT (company_id, offer_id, date) DO UPDATE SET
+    marketing_seller_price = excluded.marketing_seller_price,
+    old_price = excluded.old_price,
+    marketing_price = excluded.marketing_price,
+    marketing_oa_price = excluded.marketing_oa_price
+"""
+# sqlite: prepared once and run with executemany, so neither the statement nor the batch size depend on the number of rows
+UPSERT_OZON_PRICES = f"""
+INSERT INTO "OzonPrice" ({PRICE_ROW_COLUMNS}) VALUES ({', '.join('?' for _ in PriceRow._fields)})
+{ON_PRICE_CONFLICT}"""
+# postgresql: rows are copied to a temporary table and upserted from it with one statement,
+# a row can be updated only once by a statement, so the last row of a key wins
+PRICE_STAGING_TABLE = "ozon_price_staging"
+CREATE_PRICE_STAGING = f"""
+CREATE TEMPORARY TABLE IF NOT EXISTS {PRICE_STAGING_TABLE}
+(LIKE "OzonPrice" INCLUDING DEFAULTS, seq SERIAL) ON COMMIT DELETE ROWS
+"""
+UPSERT_OZON_PRICES_FROM_STAGING = f"""
+INSERT INTO "OzonPrice" ({PRICE_ROW_COLUMNS})
+SELECT DISTINCT ON (company_id, offer_id, date) {PRICE_ROW_COLUMNS} FROM {PRICE_STAGING_TABLE}
+ORDER BY company_id, offer_id, date, seq DESC
+{ON_PRICE_CONFLICT}"""
+
+PRICE_HISTORY_COLUMNS = (
+    'date', 'company_id', 'item_id', 'offer_id', 'name',
+    'marketing_seller_price', 'old_price', 'marketing_price', 'marketing_oa_price'
+)
+
+def price_row(price) -> PriceRow:
+    return PriceRow(*(getattr(price, field) for field in PriceRow._fields))
+
+async def upsert_price_rows(session, rows: list[PriceRow], chunk_size: int = INGEST_CHUNK_ROWS):
+    """
+    Write collected prices in the transaction of the session
+    """
+    if STORAGE_MODE == INCREMENTAL:
+        await save_price_changes(session, rows)
         return
-        
-    async with session_maker() as session:
-        values = [{
-            'company_id': price.company_id,
-            'item_id': price.item_id,
-            'offer_id': price.offer_id,
-            'name': price.name,
-            'date': price.date,
-            'marketing_seller_price': price.marketing_seller_price,
-            'old_price': price.old_price,
-            'marketing_price': price.marketing_price,
-            'marketing_oa_price': price.marketing_oa_price
-        } for price in prices]
-        
-        stmt = insert(OzonPrice).values(values)
-        
+    connection = await session.connection()
+    if connection.dialect.name == SQLITE:
+        for start in range(0, len(rows), chunk_size):
+            # dates are bound as text the way the Date type stores them in sqlite
+            await connection.exec_driver_sql(UPSERT_OZON_PRICES, [
+                (*row[:4], row.date.isoformat(), *row[5:]) for row in rows[start:start + chunk_size]
+            ])
+    elif connection.dialect.name == POSTGRESQL and connection.dialect.driver == "asyncpg":
+        await connection.exec_driver_sql(CREATE_PRICE_STAGING)
+        driver_connection = (await connection.get_raw_connection()).driver_connection
+        for start in range(0, len(rows), chunk_size):
+            await driver_connection.copy_records_to_table(
+                PRICE_STAGING_TABLE, records=rows[start:start + chunk_size], columns=PriceRow._fields
+            )
+        await connection.exec_driver_sql(UPSERT_OZON_PRICES_FROM_STAGING)
+        await connection.exec_driver_sql(f"TRUNCATE {PRICE_STAGING_TABLE}")
+    else:
+        # the last row of a key wins, as above
+        rows = list({(row.company_id, row.offer_id, row.date): row for row in rows}.values())
+        stmt = insert(OzonPrice)
         stmt = stmt.on_conflict_do_update(
             index_elements=['company_id', 'offer_id', 'date'],
-            set_={
-                'marketing_seller_price': stmt.excluded.marketing_seller_price,
-                'old_price': stmt.excluded.old_price,
-                'marketing_price': stmt.excluded.marketing_price,
-                'marketing_oa_price': stmt.excluded.marketing_oa_price
-            }
+            set_={field: stmt.excluded[field] for field in PriceRow._fields[5:]}
         )
-        
-        await session.execute(stmt)
-        await session.commit()
-        
-    logger.info(f"Bulk upserted {len(prices)} prices")
+        for start in range(0, len(rows), chunk_size):
+            await session.execute(stmt, [row._asdict() for row in rows[start:start + chunk_size]])
 
-async def get_ozon_price_change(
-    session,
+async def save_price_rows(rows: list[PriceRow], checkpoint: CollectionCheckpoint | None = None):
+    """
+    Prices and the checkpoint that covers them are committed together,
+    so a resumed collection never skips prices that were not saved
+    """
+    async with session_maker() as session, session.begin():
+        await upsert_price_rows(session, rows)
+        if checkpoint is not None:
+            await session.merge(checkpoint)
+    logger.info(f"Bulk upserted {len(rows)} prices")
+
+async def save_ozon_prices(prices: list):
+    if not prices:
+        logger.info("No prices to save")
+        return
+    await save_price_rows([price if isinstance(price, PriceRow) else price_row(price) for price in prices])
+
+async def finish_ozon_prices(company_id: str, collection_date: date):
+    """
+    Called when all prices of a company are collected for the date
+    """
+    if STORAGE_MODE == INCREMENTAL:
+        async with session_maker() as session, session.begin():
+            await close_missing_prices(session, company_id, collection_date)
+
+def previous_date_cte(target_date: date, previous_date: date | None = None):
+    """
+    The given previous date or the last collected date before target_date
+    """
+    if previous_date:
+        return select(literal(previous_date, Date).label('date')).cte('previous')
+    return select(func.coalesce(
+        select(func.max(PriceDate.date)).where(PriceDate.date < target_date).scalar_subquery(),
+        literal(target_date - timedelta(days=1), Date),
+        type_=Date
+    ).label('date')).cte('previous')
+
+# (item_id, company_id, offer_id)
+PRICE_KEY_TYPES = (str, str, str)
+
+def keyset_page(query, keyset: tuple, cursor: tuple[str, list] | None, descending: bool = False):
+    """
+    Rows after the cursor in the order of the keyset or, for a cursor before, the rows before it in reverse order
+    """
+    reverse = (cursor is not None and cursor[0] == BEFORE) != descending
+    if cursor:
+        query = query.where(tuple_(*keyset) < tuple_(*cursor[1]) if reverse else tuple_(*keyset) > tuple_(*cursor[1]))
+    return query.order_by(*(c.desc() for c in keyset)) if reverse else query.order_by(*keyset)
+
+def price_change_query(
     target_date: date,
-    previoud_date: date,
+    previous_date: date | None = None,
     limit: int = 50,
     offset: int = 0,
     company_id: str|None = None,
-    offer_id: str|None = None
-) -> list[PriceChange]:
+    offer_id: str|None = None,
+    last_known_before: date | None = None,
+    cursor: tuple[str, list] | None = None
+):
     """
-    Get paginated price changes for a specific date with optional company filter
+    Page of price changes for a specific date, the total count and the resolved previous date in one query.
+    Prices are compared with previous_date, with the last date before target_date when it is not given,
+    or, if last_known_before is set, with the last known price of each SKU before that date.
+    The page starts after or ends before the (item_id, company_id, offer_id) key of the cursor
     """
-    OzonPriceYesterday = aliased(OzonPrice)
+    filters = [PriceSource.date == target_date]
+    if company_id:
+        filters.append(PriceSource.company_id == company_id)
+    if offer_id:
+        filters.append(PriceSource.offer_id == offer_id)
+
+    previous = previous_date_cte(target_date, previous_date)
+
+    # the page is cut before the join, so only its rows are joined with the previous prices
+    page_query = select(
+        PriceSource.company_id,
+        PriceSource.offer_id,
+        PriceSource.item_id,
+        PriceSource.name,
+        PriceSource.marketing_seller_price,
+        PriceSource.marketing_oa_price,
+        PriceSource.marketing_price
+    ).where(*filters)
+    keyset = (PriceSource.item_id, PriceSource.company_id, PriceSource.offer_id)
+    page = keyset_page(page_query, keyset, cursor).limit(limit).offset(offset).cte('page')
+    total = select(func.count().label('total')).select_from(PriceSource).where(*filters).cte('total')
+
+    if PriceSource is OzonPriceView:
+        # the view is a join and can't be flattened into the right side of a left join,
+        # so it is narrowed to the SKUs of the page before the join
+        known = select(PriceSource).where(
+            tuple_(PriceSource.company_id, PriceSource.offer_id).in_(select(page.c.company_id, page.c.offer_id))
+        )
+        if last_known_before:
+            known = known.where(PriceSource.date < last_known_before)
+        else:
+            known = known.where(PriceSource.date == select(previous.c.date).scalar_subquery())
+        OzonPriceYesterday = aliased(PriceSource, known.cte('yesterday').prefix_with('MATERIALIZED'))
+    else:
+        OzonPriceYesterday = aliased(PriceSource)
+    if last_known_before:
+        OzonPriceKnown = aliased(PriceSource)
+        yesterday_date = select(func.max(OzonPriceKnown.date)).where(
+            OzonPriceKnown.company_id == page.c.company_id,
+            OzonPriceKnown.offer_id == page.c.offer_id,
+            OzonPriceKnown.date < last_known_before
+        ).scalar_subquery()
+    else:
+        yesterday_date = previous.c.date
+
     query = select(
-        OzonPrice.company_id,
-        OzonPrice.offer_id,
-        OzonPrice.name,
-        OzonPrice.marketing_seller_price.label('today_seller_price'),
-        OzonPrice.marketing_oa_price.label('today_ozon_card'),
-        OzonPrice.marketing_price.label('today_spp'),
+        total.c.total,
+        previous.c.date.label('previous_date'),
+        page.c.company_id,
+        page.c.offer_id,
+        page.c.item_id,
+        page.c.name,
+        page.c.marketing_seller_price.label('today_seller_price'),
+        page.c.marketing_oa_price.label('today_ozon_card'),
+        page.c.marketing_price.label('today_spp'),
+        OzonPriceYesterday.date.label('yesterday_date'),
         OzonPriceYesterday.marketing_seller_price.label('yesterday_seller_price'),
         OzonPriceYesterday.marketing_oa_price.label('yesterday_ozon_card'),
         OzonPriceYesterday.marketing_price.label('yesterday_spp')
     ).select_from(
-        OzonPrice
+        # total and previous date are returned even when the page is empty
+        total
+    ).join(
+        previous, true()
+    ).outerjoin(
+        page, true()
     ).outerjoin(
         OzonPriceYesterday,
         and_(
-            OzonPrice.company_id == OzonPriceYesterday.company_id,
-            OzonPrice.offer_id == OzonPriceYesterday.offer_id,
-            OzonPriceYesterday.date == previoud_date
+            page.c.company_id == OzonPriceYesterday.company_id,
+            page.c.offer_id == OzonPriceYesterday.offer_id,
+            OzonPriceYesterday.date == yesterday_date
         )
-    ).where(
-        OzonPrice.date == target_date
+    ).order_by(page.c.item_id, page.c.company_id, page.c.offer_id)
+    return query
+
+async def get_ozon_price_change(
+    session,
+    target_date: date,
+    previous_date: date | None = None,
+    limit: int = 50,
+    offset: int = 0,
+    company_id: str|None = None,
+    offer_id: str|None = None,
+    last_known_before: date | None = None,
+    cursor: str | None = None
+) -> PriceChangeResponse:
+    """
+    Page of price changes with cursors of the next and previous pages, see price_change_query
+    """
+    keyset_cursor = decode_cursor(cursor, PRICE_KEY_TYPES)
+    # one extra row tells if there is one more page in the direction of paging
+    query = price_change_query(
+        target_date, previous_date, limit + 1, offset, company_id, offer_id, last_known_before, keyset_cursor
     )
+    result = await session.execute(query)
+    return price_change_response(result.all(), target_date, limit, offset, keyset_cursor)
 
-    if company_id:
-        query = query.where(OzonPrice.company_id == company_id)
-    if offer_id:
-        query = query.where(OzonPrice.offer_id == offer_id)
+def price_change_response(
+    rows,
+    target_date: date,
+    limit: int,
+    offset: int,
+    keyset_cursor: tuple[str, list] | None,
+    key=None
+) -> PriceChangeResponse:
+    """
+    Response of a page queried with one extra row, the first row carries the total and the previous date.
+    key gives the cursor values of a row, the (item_id, company_id, offer_id) key by default
+    """
+    key = key or _price_key
+    backwards = keyset_cursor is not None and keyset_cursor[0] == BEFORE
+    page_rows = [row for row in rows if row.company_id is not None]
+    has_more = len(page_rows) > limit
+    if has_more:
+        page_rows = page_rows[1:] if backwards else page_rows[:-1]
+    has_next = not backwards and has_more or backwards
+    has_prev = backwards and has_more or not backwards and (keyset_cursor is not None or offset > 0)
 
-    query = query.order_by(OzonPrice.item_id).limit(limit).offset(offset)
+    return PriceChangeResponse(
+        price_changes=[
+            PriceChange(
+                date=target_date,
+                item_id=row.item_id,
+                previous_date=row.yesterday_date,
+                company_id=row.company_id,
+                offer_id=row.offer_id,
+                name=row.name,
+                today_seller_price=row.today_seller_price,
+                today_spp=row.today_spp,
+                today_ozon_card=row.today_ozon_card,
+                yesterday_seller_price=row.yesterday_seller_price,
+                yesterday_spp=row.yesterday_spp,
+                yesterday_ozon_card=row.yesterday_ozon_card
+            )
+            for row in page_rows
+        ],
+        total=rows[0].total,
+        previous_date=rows[0].previous_date,
+        next_cursor=encode_cursor(AFTER, key(page_rows[-1])) if page_rows and has_next else None,
+        prev_cursor=encode_cursor(BEFORE, key(page_rows[0])) if page_rows and has_prev else None
+    )
 
-    result = await session.execute(query)
-    rows = result.all()
-
-    return [
-        PriceChange(
-            date=target_date,
-            company_id=row.company_id,
-            offer_id=row.offer_id,
-            name=row.name,
-            today_seller_price=row.today_seller_price,
-            today_spp=row.today_spp,
-            today_ozon_card=row.today_ozon_card,
-            yesterday_seller_price=row.yesterday_seller_price,
-            yesterday_spp=row.yesterday_spp,
-            yesterday_ozon_card=row.yesterday_ozon_card
-        )
-        for row in rows
-    ]
+def report_filters(
+    target_date: date,
+    company_id: str|None = None,
+    offer_id: str|None = None,
+    company_ids: list[str] | None = None
+) -> list:
+    filters = [PriceSource.date == target_date]
+    if company_id:
+        filters.append(PriceSource.company_id == company_id)
+    if company_ids is not None:
+        filters.append(PriceSource.company_id.in_(company_ids))
+    if offer_id:
+        filters.append(PriceSource.offer_id == offer_id)
+    return filters
 
-async def count_ozon_price_change(
-    session,
+def price_report_query(
     target_date: date,
-    previous_date: date,
+    previous_date: date | None = None,
     company_id: str|None = None,
-    offer_id : str|None = None
-) -> int:
+    offer_id: str|None = None,
+    company_ids: list[str] | None = None
+):
     """
-    Count total price changes for a specific date with optional company filter
+    All price changes of target_date ordered by company and then as on the price page,
+    each row carries the resolved previous date
     """
-    OzonPriceYesterday = aliased(OzonPrice)
-    query = select(
-        func.count()
+    filters = report_filters(target_date, company_id, offer_id, company_ids)
+    # a scalar and not a join, so the rows are read in the order of the index without sorting
+    if previous_date:
+        previous = literal(previous_date, Date)
+    else:
+        previous = select(previous_date_cte(target_date).c.date).scalar_subquery()
+    if PriceSource is OzonPriceView:
+        # see price_change_query, the view is narrowed to the previous date before the join
+        OzonPriceYesterday = aliased(PriceSource, select(PriceSource).where(
+            PriceSource.date == previous,
+            *report_filters(target_date, company_id, offer_id, company_ids)[1:]
+        ).cte('yesterday').prefix_with('MATERIALIZED'))
+    else:
+        OzonPriceYesterday = aliased(PriceSource)
+    return select(
+        previous.label('previous_date'),
+        PriceSource.company_id,
+        PriceSource.offer_id,
+        PriceSource.item_id,
+        PriceSource.name,
+        PriceSource.marketing_seller_price.label('today_seller_price'),
+        PriceSource.marketing_oa_price.label('today_ozon_card'),
+        PriceSource.marketing_price.label('today_spp'),
+        OzonPriceYesterday.date.label('yesterday_date'),
+        OzonPriceYesterday.marketing_seller_price.label('yesterday_seller_price'),
+        OzonPriceYesterday.marketing_oa_price.label('yesterday_ozon_card'),
+        OzonPriceYesterday.marketing_price.label('yesterday_spp')
     ).select_from(
-        OzonPrice
+        PriceSource
     ).outerjoin(
         OzonPriceYesterday,
         and_(
-            OzonPrice.company_id == OzonPriceYesterday.company_id,
-            OzonPrice.offer_id == OzonPriceYesterday.offer_id,
-            OzonPriceYesterday.date == previous_date
+            PriceSource.company_id == OzonPriceYesterday.company_id,
+            PriceSource.offer_id == OzonPriceYesterday.offer_id,
+            OzonPriceYesterday.date == previous
         )
-    ).where(
-        OzonPrice.date == target_date
-    )
+    ).where(*filters).order_by(PriceSource.company_id, PriceSource.item_id, PriceSource.offer_id)
 
-    if company_id:
-        query = query.where(OzonPrice.company_id == company_id)
-    if offer_id:
-        query = query.where(OzonPrice.offer_id == offer_id)
+async def resolve_previous_date(session, target_date: date) -> date:
+    return await session.scalar(select(previous_date_cte(target_date).c.date))
 
-    result = await session.execute(query)
-    return result.scalar_one()
+async def stream_price_changes(
+    session,
+    target_date: date,
+    previous_date: date | None = None,
+    company_id: str|None = None,
+    offer_id: str|None = None,
+    company_ids: list[str] | None = None,
+    chunk_size: int = 1000
+):
+    """
+    Chunks of rows of price_report_query read with a single cursor, so the result is never held in memory
+    """
+    query = price_report_query(target_date, previous_date, company_id, offer_id, company_ids)
+    result = await session.stream(query.execution_options(yield_per=chunk_size))
+    async for rows in result.partitions():
+        yield rows
+
+def price_history_query(
+    date_from: date,
+    date_to: date,
+    company_id: str|None = None,
+    offer_id: str|None = None,
+    partitions: list[str] = ()
+):
+    """
+    Collected prices of a date range ordered by date and company, as they are exported.
+    Months moved out of OzonPrice are read from their partitions, the hot table is queried alone when there are none
+    """
+    selects = []
+    for table in [PriceSource.__table__, *map(partition_table, partitions)]:
+        filters = [table.c.date >= date_from, table.c.date <= date_to]
+        if company_id:
+            filters.append(table.c.company_id == company_id)
+        if offer_id:
+            filters.append(table.c.offer_id == offer_id)
+        selects.append(select(*(table.c[column] for column in PRICE_HISTORY_COLUMNS)).where(*filters))
+    if partitions:
+        prices = union_all(*selects).subquery('prices')
+        query = select(prices)
+    else:
+        prices = PriceSource.__table__
+        query = selects[0]
+    return query.order_by(prices.c.date, prices.c.company_id, prices.c.item_id, prices.c.offer_id)
+
+async def history_partitions(session, date_from: date, date_to: date) -> list[str]:
+    """
+    Routing of a date range to the partitions that are still in the database,
+    archived months are in their parquet files already
+    """
+    partitions = []
+    for partition in await get_partitions(session, date_from, date_to):
+        if partition.archive_path:
+            logger.warning(f"prices of {partition.month:%Y-%m} are archived to {partition.archive_path}")
+        else:
+            partitions.append(partition.table_name)
+    return partitions
+
+async def stream_price_history(
+    session,
+    date_from: date,
+    date_to: date,
+    company_id: str|None = None,
+    offer_id: str|None = None,
+    chunk_size: int = 5000
+):
+    """
+    Chunks of rows of price_history_query read with a single cursor
+    """
+    partitions = await history_partitions(session, date_from, date_to)
+    query = price_history_query(date_from, date_to, company_id, offer_id, partitions)
+    result = await session.stream(query.execution_options(yield_per=chunk_size))
+    async for rows in result.partitions():
+        yield rows
+
+def _price_key(row) -> list:
+    return [row.item_id, row.company_id, row.offer_id]
+
+def previous_day_query(today: date):
+    return select(PriceDate.date).where(PriceDate.date < today).order_by(PriceDate.date.desc()).limit(1)
 
 async def get_previous_day(today: date):
-    async with session_maker() as session:
-        result = await session.execute(
-            select(OzonPrice.date)
-            .where(OzonPrice.date < today)
-            .order_by(OzonPrice.date.desc())
-            .limit(1)
-        )
+    async with read_session_maker() as session:
+        result = await session.execute(previous_day_query(today))
         previous_date = result.scalar_one_or_none()
         return previous_date
 
@@ -1,10 +1,70 @@
 import asyncio
+import time
+from dataclasses import dataclass
 
-from src.models.database import session_maker
+from src.config import PARAMETER_CACHE_TTL_SECONDS
+from src.models.database import read_session_maker, session_maker
 from src.models.parameters import Parameter
 from sqlalchemy import select
 
 
+@dataclass(frozen=True)
+class Settings:
+    """
+    All parameters read at once, they are served from memory until a write of this module
+    or, if PARAMETER_CACHE_TTL_SECONDS is set, until they are older than that
+    """
+    company_ids: tuple[str, ...]
+    scheduled_times: tuple[str, ...]
+    cookies: str | None
+    report_path: str | None
+    loaded_at: float
+
+_settings: Settings | None = None
+# settings loaded before a write are not cached after it
+_generation = 0
+_settings_lock = asyncio.Lock()
+
+def invalidate_settings():
+    global _settings, _generation
+    _settings = None
+    _generation += 1
+
+def _is_valid(settings: Settings | None) -> bool:
+    if settings is None:
+        return False
+    # other processes write parameters too, the time to live bounds how long their changes are not seen
+    return not PARAMETER_CACHE_TTL_SECONDS or time.monotonic() - settings.loaded_at < PARAMETER_CACHE_TTL_SECONDS
+
+async def load_settings() -> Settings:
+    async with read_session_maker() as session:
+        res = await session.execute(select(Parameter).order_by(Parameter.parameter_id))
+        parameters = res.scalars().all()
+    values = {p.name: p.value for p in parameters}
+    return Settings(
+        company_ids=tuple(p.value for p in parameters if p.name == 'company_id'),
+        scheduled_times=tuple(p.value for p in parameters if p.name == 'scheduled_time'),
+        cookies=values.get('cookies'),
+        report_path=values.get('report_path'),
+        loaded_at=time.monotonic()
+    )
+
+async def get_settings() -> Settings:
+    global _settings
+    settings = _settings
+    if _is_valid(settings):
+        return settings
+    # concurrent requests wait for one load
+    async with _settings_lock:
+        if _is_valid(_settings):
+            return _settings
+        generation = _generation
+        settings = await load_settings()
+        if generation == _generation:
+            _settings = settings
+        return settings
+
+
 async def add_company_ids(company_ids: list[str]):
     company_ids = [c_id.strip() for c_id in company_ids]
     async with session_maker() as session, session.begin():
@@ -15,18 +75,17 @@ async def add_company_ids(company_ids: list[str]):
                     name='company_id',
                     value=company_id
                 ))
+    invalidate_settings()
 
 async def get_company_ids() -> list[str]:
-    async with session_maker() as session:
-        query = select(Parameter).where(Parameter.name=='company_id').order_by(Parameter.parameter_id)
-        res = await session.execute(query)
-        return [p.value for p in res.scalars().all()]
+    return list((await get_settings()).company_ids)
 
 async def delete_company_id(company_id: str):
     async with session_maker() as session, session.begin():
         company_id = await find_company_id(session, company_id)
         if company_id:
             await session.delete(company_id)
+    invalidate_settings()
 
 
 async def find_company_id(session, company_id: str) -> Parameter | None:
@@ -46,6 +105,7 @@ async def upsert_cookies(cookies_str:str):
             session.add(new_cookies)
         else:
             cookies.value = cookies_str
+    invalidate_settings()
 
 async def _get_cookies(session) -> Parameter | None:
     res = await session.execute(
@@ -55,14 +115,12 @@ async def _get_cookies(session) -> Parameter | None:
     )
     return res.scalar_one_or_none()
 
-async def get_cookies() -> Parameter | None:
-    async with session_maker() as session:
-        return await _get_cookies(session)
+async def get_cookies() -> str | None:
+    return (await get_settings()).cookies
 
 
-async def get_report_path() -> Parameter | None:
-    async with session_maker() as session:
-        return await find_parameter_by_name("report_path", session)
+async def get_report_path() -> str | None:
+    return (await get_settings()).report_path
 
 async def save_report_path(report_path: str):
     await save_parameter(Parameter(name="report_path", value=report_path))
@@ -80,17 +138,16 @@ async def save_parameter(parameter: Parameter) -> Parameter | None:
         existing = await find_parameter_by_name(parameter.name, session)
         if not existing:
             session.add(parameter)
-            return parameter
+            saved = parameter
         else:
             existing.value = parameter.value
             session.add(existing)
-        return existing
+            saved = existing
+    invalidate_settings()
+    return saved
 
 async def get_scheduled_times() -> list[str]:
-    async with session_maker() as session:
-        query = select(Parameter).where(Parameter.name=='scheduled_time').order_by(Parameter.parameter_id)
-        res = await session.execute(query)
-        return [p.value for p in res.scalars().all()]
+    return list((await get_settings()).scheduled_times)
 
 async def add_scheduled_time(scheduled_times: list[str]):
     async with session_maker() as session, session.begin():
@@ -101,6 +158,7 @@ async def add_scheduled_time(scheduled_times: list[str]):
                     name='scheduled_time',
                     value=scheduled_time
                 ))
+    invalidate_settings()
 
 async def find_scheduled_time(session, scheduled_time: str) -> Parameter | None:
     res = await session.execute(
@@ -116,6 +174,7 @@ async def delete_scheduled_time(scheduled_time: str):
         scheduled_time = await find_scheduled_time(session, scheduled_time)
         if scheduled_time:
             await session.delete(scheduled_time)
+    invalidate_settings()
 
 
 
@@ -0,0 +1,118 @@
+import logging
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import Column, MetaData, PrimaryKeyConstraint, Table, and_, delete, func, select
+
+from src.models.ozon_price import OzonPrice
+from src.models.price_partition import PricePartition
+from src.persistence.upsert import insert
+
+logger = logging.getLogger(__name__)
+
+partition_metadata = MetaData()
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+def next_month(month: date) -> date:
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def partition_name(month: date) -> str:
+    return f"OzonPrice_{month:%Y_%m}"
+
+def partition_table(name: str) -> Table:
+    """
+    Table of a month of OzonPrice. It is read by date, so the primary key starts with the date
+    and the item_id index of the hot table is not needed
+    """
+    if name in partition_metadata.tables:
+        return partition_metadata.tables[name]
+    return Table(
+        name,
+        partition_metadata,
+        *(Column(column.name, column.type) for column in OzonPrice.__table__.columns),
+        PrimaryKeyConstraint('date', 'company_id', 'offer_id')
+    )
+
+def month_weeks(month: date) -> list[tuple[date, date]]:
+    """
+    Weeks from monday to sunday cut by the bounds of the month, so every partition is sampled on its own
+    """
+    end = next_month(month) - timedelta(days=1)
+    weeks = []
+    start = month
+    while start <= end:
+        week_end = min(start + timedelta(days=6 - start.weekday()), end)
+        weeks.append((start, week_end))
+        start = week_end + timedelta(days=1)
+    return weeks
+
+async def get_partitions(session, date_from: date | None = None, date_to: date | None = None) -> list[PricePartition]:
+    """
+    Partitions of the months that overlap the dates, ordered by month
+    """
+    query = select(PricePartition).order_by(PricePartition.month)
+    if date_from:
+        query = query.where(PricePartition.month >= month_start(date_from))
+    if date_to:
+        query = query.where(PricePartition.month <= date_to)
+    return list((await session.execute(query)).scalars().all())
+
+async def unpartitioned_months(session, before: date) -> list[date]:
+    """
+    Months of the OzonPrice dates before the given date
+    """
+    dates = await session.execute(select(OzonPrice.date).where(OzonPrice.date < before).distinct())
+    return sorted({month_start(price_date) for price_date in dates.scalars().all()})
+
+async def partition_month(session, month: date) -> PricePartition:
+    """
+    Move a month of OzonPrice to its partition keeping the last collected price of each SKU in every week
+    """
+    partition = await session.get(PricePartition, month) or PricePartition(
+        month=month, table_name=partition_name(month), rows=0, source_rows=0
+    )
+    table = partition_table(partition.table_name)
+    connection = await session.connection()
+    await connection.run_sync(lambda sync_connection: table.create(sync_connection, checkfirst=True))
+
+    columns = [column.name for column in OzonPrice.__table__.columns]
+    rows = 0
+    for week_start, week_end in month_weeks(month):
+        last = select(
+            OzonPrice.company_id,
+            OzonPrice.offer_id,
+            func.max(OzonPrice.date).label('date')
+        ).where(
+            OzonPrice.date >= week_start, OzonPrice.date <= week_end
+        ).group_by(OzonPrice.company_id, OzonPrice.offer_id).subquery('last')
+        sample = select(*(getattr(OzonPrice, column) for column in columns)).join(last, and_(
+            OzonPrice.company_id == last.c.company_id,
+            OzonPrice.offer_id == last.c.offer_id,
+            OzonPrice.date == last.c.date
+        )).where(OzonPrice.date >= week_start, OzonPrice.date <= week_end)
+        # prices of a month collected again after it was moved don't replace its samples,
+        # the WHERE of the select also keeps sqlite from reading ON CONFLICT as a part of a join
+        result = await session.execute(insert(table).from_select(columns, sample).on_conflict_do_nothing())
+        rows += result.rowcount
+    result = await session.execute(
+        delete(OzonPrice).where(OzonPrice.date >= month, OzonPrice.date < next_month(month))
+        .execution_options(synchronize_session=False)
+    )
+    partition.rows += rows
+    partition.source_rows += result.rowcount
+    partition = await session.merge(partition)
+    logger.info(f"{result.rowcount} prices of {month:%Y-%m} are moved to {partition.table_name} as {rows} weekly prices")
+    return partition
+
+async def drop_partition(session, partition: PricePartition, archive_path: str):
+    """
+    The partition is archived, its table is dropped and the archive is recorded in its place
+    """
+    table = partition_table(partition.table_name)
+    connection = await session.connection()
+    await connection.run_sync(lambda sync_connection: table.drop(sync_connection, checkfirst=True))
+    partition.archive_path = archive_path
+    partition.archived_at = datetime.now()
+    await session.merge(partition)
+    logger.info(f"{partition.table_name} is archived to {archive_path}")
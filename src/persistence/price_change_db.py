@@ -0,0 +1,344 @@
+import argparse
+import asyncio
+import logging
+from datetime import date, datetime
+
+from sqlalchemy import Date, case, delete, func, literal, null, or_, select, true, union_all
+from sqlalchemy.orm import aliased
+
+from src.dto.price_change import PriceChangeResponse
+from src.models.checkpoint import CollectionCheckpoint
+from src.models.database import dispose_engines, read_session_maker, session_maker
+from src.models.price_change_daily import PriceChangeDaily, PriceChangeRefresh
+from src.persistence.keyset import decode_cursor
+from src.persistence.ozon_price_db import PRICE_KEY_TYPES, PriceDate, PriceSource, keyset_page, previous_date_cte, \
+    price_change_response, price_report_query, resolve_previous_date
+from src.persistence.upsert import insert
+
+logger = logging.getLogger(__name__)
+
+UP = "up"
+DOWN = "down"
+SAME = "same"
+# no price at the previous date
+NEW = "new"
+# a price at the previous date but not at the target date
+REMOVED = "removed"
+
+PRICE_COLUMNS = ('seller_price', 'spp', 'ozon_card')
+SUMMARY_COLUMNS = [
+    'date', 'company_id', 'offer_id', 'item_id', 'name', 'previous_date',
+    *(f'today_{column}' for column in PRICE_COLUMNS),
+    *(f'yesterday_{column}' for column in PRICE_COLUMNS),
+    *(f'delta_{column}' for column in PRICE_COLUMNS),
+    *(f'pct_{column}' for column in PRICE_COLUMNS),
+    'direction'
+]
+# the price page is sorted by the percentage or the absolute change of a price
+PCT = "pct"
+DELTA = "delta"
+# change filters of the price page, besides NEW and REMOVED
+CHANGED = "changed"
+CHANGE_FILTERS = (CHANGED, NEW, REMOVED)
+# the order of the price columns of price_change_query and price_report_query
+QUERY_PRICE_COLUMNS = ('seller_price', 'ozon_card', 'spp')
+
+def pct(today, yesterday):
+    return case((yesterday != 0, (today - yesterday) * 100.0 / yesterday), else_=null())
+
+def change_direction(changes):
+    return case(
+        (changes.c.yesterday_date.is_(None), literal(NEW)),
+        (changes.c.today_ozon_card > changes.c.yesterday_ozon_card, literal(UP)),
+        (changes.c.today_ozon_card < changes.c.yesterday_ozon_card, literal(DOWN)),
+        else_=literal(SAME)
+    )
+
+async def invalidate_price_change_daily(company_id: str, target_date: date):
+    """
+    Called when the collection of a company starts, the summary of the date is read from the prices until it is refreshed
+    """
+    async with session_maker() as session, session.begin():
+        await session.execute(delete(PriceChangeRefresh).where(
+            PriceChangeRefresh.date == target_date,
+            PriceChangeRefresh.company_id == company_id
+        ))
+
+async def refresh_price_change_daily(company_id: str, target_date: date):
+    async with session_maker() as session, session.begin():
+        rows = await refresh_company(session, company_id, target_date)
+    logger.info(f"price change summary of {company_id} for {target_date} refreshed, {rows} rows")
+
+async def refresh_company(session, company_id: str, target_date: date) -> int:
+    """
+    Recalculate the price changes of a company for the date from the collected prices
+    """
+    await session.execute(delete(PriceChangeDaily).where(
+        PriceChangeDaily.date == target_date,
+        PriceChangeDaily.company_id == company_id
+    ))
+    previous_date = await resolve_previous_date(session, target_date)
+    result = await session.execute(insert(PriceChangeDaily).from_select(
+        SUMMARY_COLUMNS, price_change_rows(target_date, previous_date, company_id)
+    ))
+
+    stmt = insert(PriceChangeRefresh).values(date=target_date, company_id=company_id, refreshed_at=datetime.now())
+    await session.execute(stmt.on_conflict_do_update(
+        index_elements=['date', 'company_id'],
+        set_={'refreshed_at': stmt.excluded.refreshed_at}
+    ))
+    return result.rowcount
+
+def price_change_rows(target_date: date, previous_date: date, company_id: str|None = None):
+    """
+    Rows of the summary of target_date computed from the prices, with SUMMARY_COLUMNS
+    """
+    previous = literal(previous_date, Date)
+    changes = price_report_query(target_date, previous_date, company_id=company_id).order_by(None).subquery()
+    changed = select(
+        literal(target_date, Date).label('date'),
+        changes.c.company_id,
+        changes.c.offer_id,
+        changes.c.item_id,
+        changes.c.name,
+        changes.c.previous_date,
+        *(changes.c[f'today_{column}'] for column in PRICE_COLUMNS),
+        *(changes.c[f'yesterday_{column}'] for column in PRICE_COLUMNS),
+        *(
+            (changes.c[f'today_{column}'] - changes.c[f'yesterday_{column}']).label(f'delta_{column}')
+            for column in PRICE_COLUMNS
+        ),
+        *(
+            pct(changes.c[f'today_{column}'], changes.c[f'yesterday_{column}']).label(f'pct_{column}')
+            for column in PRICE_COLUMNS
+        ),
+        change_direction(changes).label('direction')
+    )
+
+    # SKUs of the previous date that are gone, they are not in the report but can be filtered on the price page
+    OzonPriceToday = aliased(PriceSource)
+    removed = select(
+        literal(target_date, Date),
+        PriceSource.company_id,
+        PriceSource.offer_id,
+        PriceSource.item_id,
+        PriceSource.name,
+        previous,
+        *(null() for _ in PRICE_COLUMNS),
+        PriceSource.marketing_seller_price,
+        PriceSource.marketing_price,
+        PriceSource.marketing_oa_price,
+        *(null() for _ in PRICE_COLUMNS),
+        *(null() for _ in PRICE_COLUMNS),
+        literal(REMOVED)
+    ).where(
+        PriceSource.date == previous,
+        ~select(OzonPriceToday.offer_id).where(
+            OzonPriceToday.date == target_date,
+            OzonPriceToday.company_id == PriceSource.company_id,
+            OzonPriceToday.offer_id == PriceSource.offer_id
+        ).exists()
+    )
+    if company_id:
+        removed = removed.where(PriceSource.company_id == company_id)
+    return union_all(changed, removed)
+
+async def is_fresh(session, target_date: date, company_ids: list[str] | None = None) -> bool:
+    """
+    The summary of the date can be read when it is refreshed for every company collected at this date
+    """
+    refreshed = set((await session.execute(
+        select(PriceChangeRefresh.company_id).where(PriceChangeRefresh.date == target_date)
+    )).scalars())
+    collected = set((await session.execute(
+        select(CollectionCheckpoint.company_id).where(CollectionCheckpoint.date == target_date)
+    )).scalars())
+    if company_ids is not None:
+        refreshed &= set(company_ids)
+        collected &= set(company_ids)
+    return bool(refreshed) and collected <= refreshed
+
+def daily_filters(
+    target_date: date,
+    company_id: str|None = None,
+    offer_id: str|None = None,
+    company_ids: list[str] | None = None
+) -> list:
+    filters = [PriceChangeDaily.date == target_date, PriceChangeDaily.direction != REMOVED]
+    if company_id:
+        filters.append(PriceChangeDaily.company_id == company_id)
+    if company_ids is not None:
+        filters.append(PriceChangeDaily.company_id.in_(company_ids))
+    if offer_id:
+        filters.append(PriceChangeDaily.offer_id == offer_id)
+    return filters
+
+def daily_price_change_query(
+    target_date: date,
+    limit: int = 50,
+    offset: int = 0,
+    company_id: str|None = None,
+    offer_id: str|None = None,
+    cursor: tuple[str, list] | None = None,
+    field: str = 'ozon_card',
+    sort: str | None = None,
+    descending: bool = False,
+    min_pct: float | None = None,
+    changes: str | None = None,
+    source=None
+):
+    """
+    price_change_query read from the summary, with the same columns.
+    The page can be sorted by the PCT or DELTA change of the price field, rows without the change are left out then,
+    and filtered by the percentage change of the field and by CHANGE_FILTERS.
+    source is the summary table or price_change_rows when the summary is not refreshed.
+    The page starts after or ends before the (sort value, item_id, company_id, offer_id) key of the cursor
+    """
+    changes_source = source if source is not None else PriceChangeDaily.__table__
+    c = changes_source.c
+    filters = [c.date == target_date]
+    if company_id:
+        filters.append(c.company_id == company_id)
+    if offer_id:
+        filters.append(c.offer_id == offer_id)
+    if changes == CHANGED:
+        filters.append(c[f'delta_{field}'] != 0)
+    elif changes in (NEW, REMOVED):
+        filters.append(c.direction == changes)
+    else:
+        filters.append(c.direction != REMOVED)
+    if min_pct is not None:
+        # not abs(), so the index of the column can be used for both ranges
+        filters.append(or_(c[f'pct_{field}'] >= min_pct, c[f'pct_{field}'] <= -min_pct))
+    keyset = (c.item_id, c.company_id, c.offer_id)
+    if sort:
+        sort_column = c[f'{sort}_{field}']
+        filters.append(sort_column.is_not(None))
+        keyset = (sort_column, *keyset)
+
+    previous = previous_date_cte(target_date)
+    page = keyset_page(select(changes_source).where(*filters), keyset, cursor, descending)
+    page = page.limit(limit).offset(offset).cte('page')
+    total = select(func.count().label('total')).select_from(changes_source).where(*filters).cte('total')
+    page_keyset = [page.c[column.name] for column in keyset]
+    return select(
+        total.c.total,
+        previous.c.date.label('previous_date'),
+        page.c.company_id,
+        page.c.offer_id,
+        page.c.item_id,
+        page.c.name,
+        *(page.c[f'today_{column}'] for column in QUERY_PRICE_COLUMNS),
+        case((page.c.direction != NEW, page.c.previous_date)).label('yesterday_date'),
+        *(page.c[f'yesterday_{column}'] for column in QUERY_PRICE_COLUMNS),
+        page_keyset[0].label('sort_value')
+    ).select_from(
+        total
+    ).join(
+        previous, true()
+    ).outerjoin(
+        page, true()
+    ).order_by(*(column.desc() for column in page_keyset) if descending else page_keyset)
+
+async def get_daily_price_change(
+    session,
+    target_date: date,
+    limit: int = 50,
+    offset: int = 0,
+    company_id: str|None = None,
+    offer_id: str|None = None,
+    cursor: str | None = None,
+    field: str = 'ozon_card',
+    sort: str | None = None,
+    descending: bool = False,
+    min_pct: float | None = None,
+    changes: str | None = None,
+    live: bool = False
+) -> PriceChangeResponse:
+    """
+    Page of daily_price_change_query, with live the rows are computed from the prices
+    """
+    # a cursor of another sort doesn't match the types and starts from the first page
+    keyset_cursor = decode_cursor(cursor, (float, *PRICE_KEY_TYPES) if sort else PRICE_KEY_TYPES)
+    source = None
+    if live:
+        previous_date = await resolve_previous_date(session, target_date)
+        source = price_change_rows(target_date, previous_date, company_id).cte('changes').prefix_with('MATERIALIZED')
+    query = daily_price_change_query(
+        target_date, limit + 1, offset, company_id, offer_id, keyset_cursor,
+        field, sort, descending, min_pct, changes, source
+    )
+    result = await session.execute(query)
+    key = (lambda row: [row.sort_value, row.item_id, row.company_id, row.offer_id]) if sort else None
+    return price_change_response(result.all(), target_date, limit, offset, keyset_cursor, key)
+
+def daily_report_query(
+    target_date: date,
+    company_id: str|None = None,
+    offer_id: str|None = None,
+    company_ids: list[str] | None = None
+):
+    """
+    price_report_query read from the summary, with the same columns and order
+    """
+    return select(
+        PriceChangeDaily.previous_date,
+        PriceChangeDaily.company_id,
+        PriceChangeDaily.offer_id,
+        PriceChangeDaily.item_id,
+        PriceChangeDaily.name,
+        *(getattr(PriceChangeDaily, f'today_{column}') for column in QUERY_PRICE_COLUMNS),
+        case((PriceChangeDaily.direction != NEW, PriceChangeDaily.previous_date)).label('yesterday_date'),
+        *(getattr(PriceChangeDaily, f'yesterday_{column}') for column in QUERY_PRICE_COLUMNS)
+    ).where(
+        *daily_filters(target_date, company_id, offer_id, company_ids)
+    ).order_by(PriceChangeDaily.company_id, PriceChangeDaily.item_id, PriceChangeDaily.offer_id)
+
+async def stream_daily_price_changes(
+    session,
+    target_date: date,
+    company_id: str|None = None,
+    offer_id: str|None = None,
+    company_ids: list[str] | None = None,
+    chunk_size: int = 1000
+):
+    query = daily_report_query(target_date, company_id, offer_id, company_ids)
+    result = await session.stream(query.execution_options(yield_per=chunk_size))
+    async for rows in result.partitions():
+        yield rows
+
+async def rebuild(date_from: date | None = None, date_to: date | None = None):
+    """
+    Recalculate the summary of every collected date and company, dates in order
+    """
+    async with read_session_maker() as session:
+        query = select(PriceDate.date).distinct().order_by(PriceDate.date)
+        if date_from:
+            query = query.where(PriceDate.date >= date_from)
+        if date_to:
+            query = query.where(PriceDate.date <= date_to)
+        dates = (await session.execute(query)).scalars().all()
+    for target_date in dates:
+        async with session_maker() as session, session.begin():
+            company_ids = await session.execute(
+                select(PriceDate.company_id).where(PriceDate.date == target_date).distinct()
+            )
+            rows = 0
+            for company_id in company_ids.scalars().all():
+                rows += await refresh_company(session, company_id, target_date)
+        logger.info(f"price change summary for {target_date} rebuilt, {rows} rows")
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the daily price change summary from the collected prices")
+    parser.add_argument("--date-from", type=date.fromisoformat)
+    parser.add_argument("--date-to", type=date.fromisoformat)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(args))
+
+async def run(args):
+    await rebuild(args.date_from, args.date_to)
+    await dispose_engines()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import logging
+from datetime import date, timedelta
+
+from sqlalchemy import select, tuple_, update
+
+from src.models.database import dispose_engines, read_session_maker, session_maker
+from src.models.ozon_price import OzonPrice
+from src.models.price_history import CollectionDate, LatestPrice, PriceHistory
+from src.persistence.upsert import insert
+
+logger = logging.getLogger(__name__)
+
+PRICE_FIELDS = ('marketing_seller_price', 'old_price', 'marketing_price', 'marketing_oa_price')
+
+def price_changed(latest, price: OzonPrice) -> bool:
+    return any(getattr(latest, field) != getattr(price, field) for field in PRICE_FIELDS)
+
+def history_row(price: OzonPrice) -> dict:
+    return {
+        'company_id': price.company_id,
+        'offer_id': price.offer_id,
+        'valid_from': price.date,
+        'valid_to': None,
+        'item_id': price.item_id,
+        'name': price.name,
+        **{field: getattr(price, field) for field in PRICE_FIELDS}
+    }
+
+async def save_price_changes(session, prices: list[OzonPrice]) -> int:
+    """
+    Incremental storage of collected prices: LatestPrice is updated in place,
+    PriceHistory gets a new interval only for the SKUs whose prices changed.
+    Dates are expected to be collected in order. Returns the number of changed SKUs
+    """
+    by_date: dict[date, dict[tuple, OzonPrice]] = {}
+    for price in prices:
+        by_date.setdefault(price.date, {})[(price.company_id, price.offer_id)] = price
+    changed = 0
+    for price_date in sorted(by_date):
+        changed += await save_date_price_changes(session, list(by_date[price_date].values()))
+    return changed
+
+async def save_date_price_changes(session, prices: list[OzonPrice]) -> int:
+    """
+    save_price_changes for prices of one date, a SKU at most once
+    """
+    if not prices:
+        return 0
+    keys = [(price.company_id, price.offer_id) for price in prices]
+    # plain rows and not entities, an entity of the identity map would not see the upserts below
+    result = await session.execute(
+        select(LatestPrice.__table__).where(tuple_(LatestPrice.company_id, LatestPrice.offer_id).in_(keys))
+    )
+    latest = {(row.company_id, row.offer_id): row for row in result}
+
+    opened = []
+    closed = []
+    replaced = []
+    latest_values = []
+    for price in prices:
+        current = latest.get((price.company_id, price.offer_id))
+        valid_from = price.date
+        if current is None or current.valid_from is None:
+            # a new SKU or one that is back in the catalogue
+            opened.append(history_row(price))
+        elif not price_changed(current, price):
+            valid_from = current.valid_from
+        elif current.valid_from == price.date:
+            # prices of the same date are collected again, the interval that starts at this date is replaced
+            replaced.append(history_row(price))
+        else:
+            closed.append({
+                'company_id': current.company_id,
+                'offer_id': current.offer_id,
+                'valid_from': current.valid_from,
+                'valid_to': min(current.date, price.date - timedelta(days=1))
+            })
+            opened.append(history_row(price))
+        latest_values.append({
+            'company_id': price.company_id,
+            'offer_id': price.offer_id,
+            'item_id': price.item_id,
+            'name': price.name,
+            'date': price.date,
+            'valid_from': valid_from,
+            **{field: getattr(price, field) for field in PRICE_FIELDS}
+        })
+
+    # bulk updates by primary key
+    if closed:
+        await session.execute(update(PriceHistory), closed)
+    if replaced:
+        await session.execute(update(PriceHistory), replaced)
+    if opened:
+        await session.execute(insert(PriceHistory).values(opened).on_conflict_do_nothing())
+
+    stmt = insert(LatestPrice).values(latest_values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['company_id', 'offer_id'],
+        set_={column: stmt.excluded[column] for column in ('item_id', 'name', 'date', 'valid_from', *PRICE_FIELDS)}
+    )
+    await session.execute(stmt)
+
+    collection_dates = {(price.date, price.company_id) for price in prices}
+    await session.execute(
+        insert(CollectionDate).values([
+            {'date': collection_date, 'company_id': company_id} for collection_date, company_id in collection_dates
+        ]).on_conflict_do_nothing()
+    )
+    changed = len(opened) + len(replaced)
+    logger.info(f"saved {len(prices)} prices incrementally, {changed} of them changed")
+    return changed
+
+async def close_missing_prices(session, company_id: str, collection_date: date):
+    """
+    When the collection of a company is finished, SKUs that were not collected at this date
+    are no longer in the catalogue, their open intervals end at the last date they were seen
+    """
+    last_seen = select(LatestPrice.date).where(
+        LatestPrice.company_id == PriceHistory.company_id,
+        LatestPrice.offer_id == PriceHistory.offer_id
+    ).scalar_subquery()
+    result = await session.execute(
+        update(PriceHistory).where(
+            PriceHistory.company_id == company_id,
+            PriceHistory.valid_to.is_(None),
+            last_seen < collection_date
+        ).values(valid_to=last_seen).execution_options(synchronize_session=False)
+    )
+    # no open interval, the next time the SKU is seen a new one is opened
+    await session.execute(
+        update(LatestPrice).where(
+            LatestPrice.company_id == company_id,
+            LatestPrice.date < collection_date,
+            LatestPrice.valid_from.is_not(None)
+        ).values(valid_from=None).execution_options(synchronize_session=False)
+    )
+    if result.rowcount:
+        logger.info(f"{result.rowcount} products of {company_id} are not in the catalogue since {collection_date}")
+
+async def backfill(date_from: date | None = None, chunk_size: int = 5000):
+    """
+    Replay the full OzonPrice table into the incremental tables date by date
+    """
+    async with read_session_maker() as session:
+        query = select(OzonPrice.date).distinct().order_by(OzonPrice.date)
+        if date_from:
+            query = query.where(OzonPrice.date >= date_from)
+        dates = (await session.execute(query)).scalars().all()
+    for price_date in dates:
+        async with session_maker() as session, session.begin():
+            result = await session.stream(
+                select(OzonPrice.__table__).where(OzonPrice.date == price_date).execution_options(yield_per=chunk_size)
+            )
+            async for prices in result.partitions():
+                await save_price_changes(session, prices)
+            company_ids = await session.execute(
+                select(OzonPrice.company_id).where(OzonPrice.date == price_date).distinct()
+            )
+            for company_id in company_ids.scalars().all():
+                await close_missing_prices(session, company_id, price_date)
+        logger.info(f"prices of {price_date} are moved to the incremental storage")
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill the incremental price storage from OzonPrice")
+    parser.add_argument("--date-from", type=date.fromisoformat)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(args))
+
+async def run(args):
+    await backfill(args.date_from)
+    await dispose_engines()
+
+if __name__ == '__main__':
+    main()
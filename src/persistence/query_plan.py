@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import re
+from datetime import date
+
+from sqlalchemy import text
+
+from src.models.database import engine
+from src.persistence.keyset import AFTER
+from src.persistence.ozon_price_db import previous_day_query, price_change_query, price_history_query, \
+    price_report_query
+from src.persistence.price_change_db import NEW, PCT, daily_price_change_query, daily_report_query
+from src.persistence.task_db import tasks_query
+
+logger = logging.getLogger(__name__)
+
+TABLES = {"OzonPrice", "PriceChangeDaily", "Task"}
+
+def hot_queries(target_date: date) -> dict:
+    """
+    Queries of the price page, the task page and the report, checked with EXPLAIN QUERY PLAN
+    """
+    return {
+        "price change": price_change_query(target_date),
+        "price change by company": price_change_query(target_date, company_id="1"),
+        "price change by offer": price_change_query(target_date, offer_id="1"),
+        "price change with last known price": price_change_query(target_date, last_known_before=target_date),
+        "price change after cursor": price_change_query(target_date, cursor=(AFTER, ["1", "1", "1"])),
+        "price change by company after cursor": price_change_query(
+            target_date, company_id="1", cursor=(AFTER, ["1", "1", "1"])
+        ),
+        "daily price change": daily_price_change_query(target_date),
+        "daily price change by company after cursor": daily_price_change_query(
+            target_date, company_id="1", cursor=(AFTER, ["1", "1", "1"])
+        ),
+        "daily price change sorted by change after cursor": daily_price_change_query(
+            target_date, sort=PCT, descending=True, cursor=(AFTER, [1.0, "1", "1", "1"])
+        ),
+        "daily price change changed by percent": daily_price_change_query(target_date, sort=PCT, min_pct=5),
+        "daily new products": daily_price_change_query(target_date, changes=NEW),
+        "report": price_report_query(target_date),
+        "report by company": price_report_query(target_date, company_id="1"),
+        "report of several companies": price_report_query(target_date, company_ids=["1", "2"]),
+        "daily report": daily_report_query(target_date),
+        "daily report of several companies": daily_report_query(target_date, company_ids=["1", "2"]),
+        "export": price_history_query(target_date, target_date),
+        "export by company": price_history_query(target_date, target_date, company_id="1"),
+        "previous day": previous_day_query(target_date),
+        "tasks after cursor": tasks_query(cursor=(AFTER, [target_date.isoformat(), 1])),
+    }
+
+def plan_problems(plan: list[tuple]) -> list[str]:
+    """
+    Full scans of tables and temporary sorts found in the plan.
+    The sort at the top level is allowed, it only orders the page that is already cut by limit
+    """
+    problems = []
+    for _, parent, _, detail in plan:
+        scan = re.match(r"SCAN (\w+)", detail)
+        if scan and scan.group(1) in TABLES:
+            problems.append(detail)
+        elif "USE TEMP B-TREE" in detail and parent != 0:
+            problems.append(detail)
+    return problems
+
+async def explain(conn, query) -> list[tuple]:
+    sql = str(query.compile(engine.sync_engine, compile_kwargs={"literal_binds": True}))
+    result = await conn.execute(text("EXPLAIN QUERY PLAN " + sql))
+    return [tuple(row) for row in result]
+
+async def check_query_plans(target_date: date | None = None) -> dict[str, list[str]]:
+    """
+    Warn about hot queries that do not use indexes. Returns problems by query name
+    """
+    if engine.dialect.name != "sqlite":
+        return {}
+    target_date = target_date or date.today()
+    problems = {}
+    async with engine.connect() as conn:
+        for name, query in hot_queries(target_date).items():
+            query_problems = plan_problems(await explain(conn, query))
+            if query_problems:
+                logger.warning(f"query '{name}' does not use indexes: {'; '.join(query_problems)}")
+                problems[name] = query_problems
+    return problems
+
+async def main():
+    if engine.dialect.name != "sqlite":
+        print("query plans are checked only for sqlite")
+        await engine.dispose()
+        return
+    async with engine.connect() as conn:
+        for name, query in hot_queries(date.today()).items():
+            print(f"-- {name}")
+            for _, parent, _, detail in await explain(conn, query):
+                print(f"{parent:>4} {detail}")
+    problems = await check_query_plans()
+    print("no problems found" if not problems else f"{len(problems)} queries with problems")
+    await engine.dispose()
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,23 +1,55 @@
 import asyncio
-from sqlalchemy import select, func
+from datetime import datetime
+
+from sqlalchemy import select, func, tuple_
 from src.models.task import Task
 from src.models.database import session_maker
+from src.persistence.keyset import AFTER, BEFORE, decode_cursor, encode_cursor
 import logging
 
 logger = logging.getLogger(__name__)
 
+# (created_at, task_id)
+TASK_KEY_TYPES = (datetime, int)
+
 async def save_task(task: Task):
     async with session_maker() as session, session.begin():
         session.add(task)
 
-async def get_tasks(session, limit: int = 50, offset: int = 0):
-    result = await session.execute(
-        select(Task)
-        .order_by(Task.created_at.desc())
-        .limit(limit)
-        .offset(offset)
-    )
-    return result.scalars().all()
+def tasks_query(limit: int = 50, cursor: tuple[str, list] | None = None):
+    """
+    Page of tasks from the newest, after or before the (created_at, task_id) key of the cursor
+    """
+    query = select(Task)
+    if cursor:
+        direction, (created_at, task_id) = cursor
+        key = tuple_(Task.created_at, Task.task_id)
+        value = tuple_(created_at, task_id)
+        if direction == BEFORE:
+            return query.where(key > value).order_by(Task.created_at, Task.task_id).limit(limit)
+        query = query.where(key < value)
+    return query.order_by(Task.created_at.desc(), Task.task_id.desc()).limit(limit)
+
+async def get_tasks(session, limit: int = 50, cursor: str | None = None) -> tuple[list[Task], str | None, str | None]:
+    """
+    Page of tasks with cursors of the next and previous pages
+    """
+    keyset_cursor = decode_cursor(cursor, TASK_KEY_TYPES)
+    backwards = keyset_cursor is not None and keyset_cursor[0] == BEFORE
+    result = await session.execute(tasks_query(limit + 1, keyset_cursor))
+    tasks = list(result.scalars().all())
+    has_more = len(tasks) > limit
+    tasks = tasks[:limit]
+    if backwards:
+        tasks.reverse()
+    has_next = not backwards and has_more or backwards
+    has_prev = backwards and has_more or not backwards and keyset_cursor is not None
+    next_cursor = encode_cursor(AFTER, _task_key(tasks[-1])) if tasks and has_next else None
+    prev_cursor = encode_cursor(BEFORE, _task_key(tasks[0])) if tasks and has_prev else None
+    return tasks, next_cursor, prev_cursor
+
+def _task_key(task: Task) -> list:
+    return [task.created_at.isoformat(), task.task_id]
 
 async def count_tasks(session):
     result = await session.execute(select(func.count(Task.task_id)))
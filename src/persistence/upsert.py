@@ -0,0 +1,14 @@
+from sqlalchemy.dialects import postgresql, sqlite
+
+from src.models.database import POSTGRESQL, SQLITE, engine
+
+def insert(table):
+    """
+    INSERT of the configured database with its ON CONFLICT clauses,
+    on_conflict_do_update and on_conflict_do_nothing are the same for sqlite and postgresql
+    """
+    if engine.dialect.name == POSTGRESQL:
+        return postgresql.insert(table)
+    if engine.dialect.name == SQLITE:
+        return sqlite.insert(table)
+    raise RuntimeError(f"upserts are not supported for {engine.dialect.name}")
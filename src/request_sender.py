@@ -0,0 +1,37 @@
+from abc import ABC, abstractmethod
+
+
+class RequestError(Exception):
+    def __init__(self, message: str, status: int | None = None, retry_after: float | None = None):
+        super().__init__(message)
+        self.status = status
+        # seconds from the Retry-After header of a 429 or 503
+        self.retry_after = retry_after
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Retry-After in seconds, the http date form is ignored and the usual backoff is used
+    """
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+AUTH_ERROR_STATUSES = {401, 403}
+
+class RequestSender(ABC):
+    """
+    Transport used by OzonApi to send requests to the seller api
+    """
+
+    @abstractmethod
+    async def ensure_ready(self):
+        """Start the transport if it is not started yet"""
+
+    @abstractmethod
+    async def close(self):
+        ...
+
+    @abstractmethod
+    async def send_request(self, method: str, url: str, payload: dict) -> dict:
+        """Send a json request, raise RequestError with the http status when it fails"""
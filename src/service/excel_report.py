@@ -0,0 +1,208 @@
+import os
+import re
+import uuid
+from datetime import date
+
+from openpyxl import Workbook
+
+SHEET_NAME = 'Price Changes'
+SUMMARY_SHEET_NAME = 'Summary'
+COLUMNS = [
+    'offer_id',
+    'name',
+    'yesterday_seller_price',
+    'yesterday_spp',
+    'yesterday_ozon_card',
+    'today_seller_price',
+    'today_spp',
+    'today_ozon_card',
+]
+# rows are sent to the report worker as tuples of these columns,
+# the previous date comes with the rows, so the headers and the summary match the query that read them
+ROW_COLUMNS = ['company_id', 'previous_date', *COLUMNS]
+
+# one workbook with all rows in one sheet
+SINGLE = "single"
+# a workbook per company
+COMPANY = "company"
+# one workbook with a sheet per company and a summary sheet
+CONSOLIDATED = "consolidated"
+COMPANY_PLACEHOLDER = "{company_id}"
+
+YESTERDAY_OZON_CARD = COLUMNS.index('yesterday_ozon_card')
+TODAY_OZON_CARD = COLUMNS.index('today_ozon_card')
+
+class ReportSheet:
+    """
+    Sheet of price changes, appended row by row, counts the changes of the Ozon card price for the summary
+    """
+
+    def __init__(self, sheet, target_date: date, previous_date: date):
+        self.sheet = sheet
+        self.rows = 0
+        self.up = 0
+        self.down = 0
+        self.same = 0
+        self.new = 0
+        report_date = target_date.strftime("%Y-%m-%d")
+        previous = previous_date.strftime("%Y-%m-%d")
+        self.sheet.append([
+            'offer_id',
+            'name',
+            'Цена Продажи ' + previous,
+            'СПП ' + previous,
+            'Карта Озон ' + previous,
+            'Цена Продажи ' + report_date,
+            'СПП ' + report_date,
+            'Карта Озон ' + report_date,
+            'Изменение Цены %'
+        ])
+
+    def write(self, values):
+        """
+        Values of a row in the order of COLUMNS
+        """
+        self.rows += 1
+        # the header is the first row
+        excel_row = self.rows + 1
+        self.sheet.append([*values, f'=H{excel_row}/E{excel_row}'])
+        yesterday, today = values[YESTERDAY_OZON_CARD], values[TODAY_OZON_CARD]
+        # the same as the direction of PriceChangeDaily, a price of 0 is a price
+        if yesterday is None:
+            self.new += 1
+        elif today is not None and today > yesterday:
+            self.up += 1
+        elif today is not None and today < yesterday:
+            self.down += 1
+        else:
+            self.same += 1
+
+class ExcelReportWriter:
+    """
+    Price change report written in openpyxl write-only mode,
+    rows are flushed to temporary files and only the current row is kept in memory
+    """
+
+    def __init__(self, filename: str, target_date: date, previous_date: date, summary: bool = False):
+        self.filename = filename
+        # the report gets its name when it is complete, a failed report leaves no file behind.
+        # Reports of the same name written at the same time don't share the temporary file
+        self.temporary_filename = f"{filename}.{uuid.uuid4().hex}.tmp"
+        self.target_date = target_date
+        self.previous_date = previous_date
+        self.workbook = Workbook(write_only=True)
+        # the summary goes first, it is filled when all the sheets are written
+        self.summary = self.workbook.create_sheet(SUMMARY_SHEET_NAME) if summary else None
+        self.sheets: dict[str, ReportSheet] = {}
+
+    @property
+    def rows(self) -> int:
+        return sum(sheet.rows for sheet in self.sheets.values())
+
+    def sheet(self, title: str = SHEET_NAME, previous_date: date | None = None) -> ReportSheet:
+        if title not in self.sheets:
+            # sheet titles are limited to 31 characters without []:*?/\
+            sheet = self.workbook.create_sheet(re.sub(r'[\[\]:*?/\\]', '_', title)[:31])
+            self.sheets[title] = ReportSheet(sheet, self.target_date, previous_date or self.previous_date)
+        return self.sheets[title]
+
+    def write(self, values):
+        self.sheet().write(values)
+
+    def save(self):
+        if self.summary is not None:
+            self.summary.append(['Компания', 'Товаров', 'Подорожало', 'Подешевело', 'Без изменений', 'Без прошлой цены'])
+            for title, sheet in self.sheets.items():
+                self.summary.append([title, sheet.rows, sheet.up, sheet.down, sheet.same, sheet.new])
+        self.workbook.save(self.temporary_filename)
+        os.replace(self.temporary_filename, self.filename)
+
+    def discard(self):
+        """
+        Drop an unfinished report. The rows already written are kept by openpyxl in temporary files
+        until the workbook is saved, so it is saved to the temporary file that is removed
+        """
+        try:
+            self.workbook.save(self.temporary_filename)
+        except Exception:
+            # saving failed already
+            pass
+        finally:
+            if os.path.exists(self.temporary_filename):
+                os.remove(self.temporary_filename)
+
+class ReportRenderer:
+    """
+    Writes chunks of ROW_COLUMNS tuples ordered by company.
+    COMPANY_PLACEHOLDER in filename is replaced with the company id in the company mode
+    """
+
+    def __init__(self, mode: str, filename: str, target_date: date):
+        self.mode = mode
+        self.filename = filename
+        self.target_date = target_date
+        self.writer: ExcelReportWriter | None = None
+        self.company_id = None
+        # the file and the number of rows of every company
+        self.reports: dict[str, tuple[str, int]] = {}
+
+    def write(self, rows):
+        try:
+            for row in rows:
+                company_id, previous_date = row[0], row[1]
+                if self.writer is None or self.mode == COMPANY and company_id != self.company_id:
+                    if self.writer is not None:
+                        self.writer.save()
+                    self.writer = ExcelReportWriter(
+                        self.filename.replace(COMPANY_PLACEHOLDER, company_id) if self.mode == COMPANY else self.filename,
+                        self.target_date,
+                        previous_date,
+                        summary=self.mode == CONSOLIDATED
+                    )
+                self.company_id = company_id
+                if self.mode == CONSOLIDATED:
+                    sheet = self.writer.sheet(company_id, previous_date)
+                else:
+                    sheet = self.writer.sheet()
+                sheet.write(row[2:])
+                written = self.reports.get(self.company_id, (self.writer.filename, 0))[1]
+                self.reports[self.company_id] = (self.writer.filename, written + 1)
+        except BaseException:
+            self.discard()
+            raise
+
+    def finish(self) -> dict[str, tuple[str, int]]:
+        try:
+            if self.writer is not None:
+                self.writer.save()
+        except BaseException:
+            self.discard()
+            raise
+        return self.reports
+
+    def discard(self):
+        if self.writer is not None:
+            self.writer.discard()
+            self.writer = None
+
+# Report jobs of a worker. The report pool sends the chunks of a job to the same single worker,
+# only this module is imported by a worker process
+_jobs: dict[int, ReportRenderer] = {}
+
+def start_report(job_id: int, mode: str, filename: str, target_date: date):
+    _jobs[job_id] = ReportRenderer(mode, filename, target_date)
+
+def write_report_rows(job_id: int, rows: list[tuple]):
+    try:
+        _jobs[job_id].write(rows)
+    except BaseException:
+        # the report is discarded already
+        _jobs.pop(job_id, None)
+        raise
+
+def finish_report(job_id: int) -> dict[str, tuple[str, int]]:
+    return _jobs.pop(job_id).finish()
+
+def discard_report(job_id: int):
+    if (renderer := _jobs.pop(job_id, None)) is not None:
+        renderer.discard()
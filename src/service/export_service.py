@@ -0,0 +1,134 @@
+import argparse
+import asyncio
+import csv
+import io
+import logging
+import os
+from datetime import date
+
+from src.models.database import dispose_engines, read_session_maker
+from src.persistence.ozon_price_db import stream_price_history
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = [
+    'date',
+    'company_id',
+    'item_id',
+    'offer_id',
+    'name',
+    'marketing_seller_price',
+    'old_price',
+    'marketing_price',
+    'marketing_oa_price',
+]
+
+async def iter_csv(date_from: date, date_to: date, company_id: str|None = None, offer_id: str|None = None):
+    """
+    Price history as CSV text, a piece per chunk of rows, for files and streaming responses
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    async with read_session_maker() as session, session.begin():
+        async for rows in stream_price_history(session, date_from, date_to, company_id, offer_id):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(rows)
+            yield buffer.getvalue()
+
+async def export_csv(path: str, date_from: date, date_to: date, company_id: str|None = None, offer_id: str|None = None):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        async for text in iter_csv(date_from, date_to, company_id, offer_id):
+            f.write(text)
+    logger.info(f"prices from {date_from} to {date_to} exported to {path}")
+    return path
+
+async def export_parquet(
+    directory: str,
+    date_from: date,
+    date_to: date,
+    company_id: str|None = None,
+    offer_id: str|None = None
+) -> list[str]:
+    """
+    Price history as Parquet files partitioned by date and company: directory/date=.../company_id=.../prices.parquet.
+    Rows are written in record batches as they are read, one partition file is open at a time.
+    Needs pyarrow, it is an optional dependency
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("parquet export needs pyarrow: uv sync --extra parquet") from e
+
+    # date and company are the partition keys, they are not repeated in the files
+    schema = pa.schema([
+        ('item_id', pa.string()),
+        ('offer_id', pa.string()),
+        ('name', pa.string()),
+        ('marketing_seller_price', pa.float64()),
+        ('old_price', pa.float64()),
+        ('marketing_price', pa.float64()),
+        ('marketing_oa_price', pa.float64()),
+    ])
+    files = []
+    writer = None
+    partition = None
+
+    def write(rows):
+        batch = pa.record_batch([[row[i] for row in rows] for i in range(2, len(EXPORT_COLUMNS))], schema=schema)
+        writer.write_batch(batch)
+
+    def open_partition(key) -> str:
+        path = os.path.join(directory, f"date={key[0].isoformat()}", f"company_id={key[1]}")
+        os.makedirs(path, exist_ok=True)
+        return os.path.join(path, "prices.parquet")
+
+    try:
+        async with read_session_maker() as session, session.begin():
+            async for rows in stream_price_history(session, date_from, date_to, company_id, offer_id):
+                # rows are ordered by date and company, so a partition is a run of consecutive rows
+                start = 0
+                for i, row in enumerate(rows):
+                    if (row.date, row.company_id) == partition:
+                        continue
+                    if start < i:
+                        await asyncio.to_thread(write, rows[start:i])
+                    if writer is not None:
+                        writer.close()
+                    partition = (row.date, row.company_id)
+                    files.append(open_partition(partition))
+                    writer = pq.ParquetWriter(files[-1], schema, compression="zstd")
+                    start = i
+                if start < len(rows):
+                    await asyncio.to_thread(write, rows[start:])
+    finally:
+        if writer is not None:
+            writer.close()
+    logger.info(f"prices from {date_from} to {date_to} exported to {len(files)} parquet files in {directory}")
+    return files
+
+def main():
+    parser = argparse.ArgumentParser(description="Export of the collected prices")
+    parser.add_argument("format", choices=["csv", "parquet"])
+    parser.add_argument("--date-from", type=date.fromisoformat, required=True)
+    parser.add_argument("--date-to", type=date.fromisoformat, help="the same as --date-from by default")
+    parser.add_argument("--company-id")
+    parser.add_argument("--offer-id")
+    parser.add_argument("--output", required=True, help="csv file or parquet directory")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(args))
+
+async def run(args):
+    date_to = args.date_to or args.date_from
+    if args.format == "csv":
+        await export_csv(args.output, args.date_from, date_to, args.company_id, args.offer_id)
+    else:
+        await export_parquet(args.output, args.date_from, date_to, args.company_id, args.offer_id)
+    await dispose_engines()
+
+if __name__ == '__main__':
+    main()
@@ -1,187 +1,332 @@
 import asyncio
 from datetime import datetime, date, timedelta
-import pandas as pd
 
 from src.api.ozon_api import OzonApi
+from src.config import INGEST_COMMIT_PAGES, LIST_PAGE_SIZE, PIPELINE_QUEUE_SIZE, PRICE_BATCH_SIZE, REPORT_MODE
 from src.dto.item_dto import Item
 from src.dto.price_change import PriceChangeResponse
 from src.dto.price_dto import Price
 
-from src.models.database import session_maker
-from src.models.ozon_price import OzonPrice
-from src.persistence.ozon_price_db import count_ozon_price_change, get_ozon_price_change, get_previous_day, \
-    save_ozon_prices
+from src.models.checkpoint import CollectionCheckpoint
+from src.models.database import read_session_maker
+from src.persistence.ozon_price_db import PriceRow, finish_ozon_prices, get_ozon_price_change, save_price_rows, \
+    stream_price_changes
+from src.persistence.checkpoint_db import get_checkpoint, save_checkpoint
+from src.persistence.price_change_db import get_daily_price_change, invalidate_price_change_daily, \
+    is_fresh, refresh_price_change_daily, stream_daily_price_changes
 from src.persistence.parameters_db import get_report_path
+from src.request_sender import RequestError
+from src.service.excel_report import COMPANY, COMPANY_PLACEHOLDER, CONSOLIDATED, SINGLE
+from src.service.report_pool import ReportPool
 import os
 import logging
 
 logger = logging.getLogger(__name__)
 
+PAYLOAD_TOO_LARGE = 413
+# a rejected batch is halved at most this many times, 200 items become 25
+MAX_BATCH_SPLITS = 3
+
+def is_batch_too_large(e: RequestError) -> bool:
+    # other bad requests, like a wrong company id or item id, fail the same way with any batch size
+    return e.status == PAYLOAD_TOO_LARGE
+
 class OzonService:
-    def __init__(self, api: OzonApi):
+    def __init__(
+        self,
+        api: OzonApi,
+        price_batch_size: int = PRICE_BATCH_SIZE,
+        list_page_size: int = LIST_PAGE_SIZE,
+        report_pool: ReportPool | None = None,
+        commit_pages: int = INGEST_COMMIT_PAGES
+    ):
         self.api = api
+        self.price_batch_size = max(1, price_batch_size)
+        self.list_page_size = list_page_size
+        self.commit_pages = max(1, commit_pages)
+        self.report_pool = report_pool or ReportPool()
+
+    async def open_browser(self):
+        await self.api.open_browser()
+
+    async def close_browser(self):
+        await self.api.close_browser()
+
+    def close_report_pool(self):
+        self.report_pool.shutdown()
 
     async def get_ozon_prices(self, today: date, company_id: str):
-        try:
-            limit = 50
-            offset = 0
-            has_next = True
-            page = 1
-            await self.api.open_browser()
-            while has_next:
-                products_response = await self.api.list_by_filter(company_id, limit=limit, offset=offset)
-                item_ids = [item.item_id for item in products_response.products]
-                price_response = await self.api.get_common_prices(company_id, item_ids)
+        """
+        Load prices of one company. Listing, price requests and saving run as a pipeline:
+        the next page is listed while the previous one is priced and saved.
+        Progress is checkpointed after every save, an interrupted collection of the same day
+        resumes from the last checkpoint.
+        The browser session is shared by all companies and is started lazily by the request sender
+        """
+        checkpoint = await get_checkpoint(company_id, today)
+        if checkpoint is None or checkpoint.finished:
+            checkpoint = CollectionCheckpoint(
+                company_id=company_id, date=today, next_offset=0, cursor=None, pages_done=0, items_saved=0, finished=False
+            )
+        else:
+            logger.info(f"resuming {company_id} from offset {checkpoint.next_offset}, {checkpoint.pages_done} pages done")
+        # the price changes of the date are read from the prices until the collection is finished
+        await invalidate_price_change_daily(company_id, today)
 
-                await self.convert_and_save_ozon_prices(products_response.products, price_response.items, today)
+        pages_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        prices_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        # a failed request stops the stages before it, but what is already fetched is still saved
+        # so that the checkpoint covers it
+        stop = asyncio.Event()
+        errors: list[Exception] = []
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(self._list_products(checkpoint, pages_queue, stop, errors))
+                tg.create_task(self._fetch_prices(company_id, pages_queue, prices_queue, stop, errors))
+                tg.create_task(self._save_prices(checkpoint, prices_queue, errors))
+        except ExceptionGroup as e:
+            # report the error that stopped the pipeline, not the group
+            raise e.exceptions[0]
+        if errors:
+            raise errors[0]
 
+    async def _list_products(
+        self, checkpoint: CollectionCheckpoint, pages_queue: asyncio.Queue, stop: asyncio.Event, errors: list[Exception]
+    ):
+        company_id = checkpoint.company_id
+        offset = checkpoint.next_offset
+        page = 1
+        try:
+            async for products_response in self.api.iter_products(
+                company_id, limit=self.list_page_size, offset=offset, cursor=checkpoint.cursor
+            ):
                 offset += len(products_response.products)
-                has_next = len(products_response.products) > 0
-                logger.info(f"loaded {len(products_response.products)} products on {page} page")
+                await pages_queue.put((products_response.products, offset, products_response.cursor))
+                logger.info(
+                    f"listed {len(products_response.products)} products on {page} page for {company_id}, "
+                    f"{offset} of {products_response.total_items}"
+                )
                 page += 1
-                await asyncio.sleep(0.5)
-        finally:
-            await self.api.close_browser()
+                if stop.is_set():
+                    break
+        except Exception as e:
+            logger.warning(f"listing products of {company_id} failed at offset {offset}: {e}")
+            errors.append(e)
+        await pages_queue.put(None)
 
+    async def _fetch_prices(
+        self,
+        company_id: str,
+        pages_queue: asyncio.Queue,
+        prices_queue: asyncio.Queue,
+        stop: asyncio.Event,
+        errors: list[Exception]
+    ):
+        # items of several listing pages are priced in one request,
+        # the size is reduced for this company only when the api rejects a batch as too large
+        batch_size = self.price_batch_size
+        buffer: list[Item] = []
+        # [next_offset, cursor, items not priced yet] of the pages in the buffer
+        pending_pages: list[list] = []
+        has_next = True
+        try:
+            while has_next:
+                page = await pages_queue.get()
+                if page is not None:
+                    items, next_offset, cursor = page
+                    buffer.extend(items)
+                    pending_pages.append([next_offset, cursor, len(items)])
+                else:
+                    has_next = False
+                while buffer and (len(buffer) >= batch_size or not has_next):
+                    batch, buffer = buffer[:batch_size], buffer[batch_size:]
+                    prices, accepted = await self._get_common_prices(company_id, batch)
+                    if accepted < len(batch):
+                        logger.warning(f"price batches of {company_id} are reduced from {batch_size} to {accepted} items")
+                        batch_size = accepted
+                    # only pages whose items are all priced can be checkpointed
+                    remaining = len(batch)
+                    finished_pages = []
+                    while pending_pages and pending_pages[0][2] <= remaining:
+                        remaining -= pending_pages[0][2]
+                        finished_pages.append(pending_pages.pop(0))
+                    if pending_pages:
+                        pending_pages[0][2] -= remaining
+                    await prices_queue.put((batch, prices, finished_pages))
+        except Exception as e:
+            logger.warning(f"getting prices of {company_id} failed: {e}")
+            errors.append(e)
+            stop.set()
+            while has_next:
+                has_next = await pages_queue.get() is not None
+        await prices_queue.put(None)
+
+    async def _get_common_prices(
+        self, company_id: str, items: list[Item], splits: int = MAX_BATCH_SPLITS
+    ) -> tuple[list[Price], int]:
+        """
+        Prices of the items and the largest batch size the api accepted,
+        a batch rejected as too large is split in halves up to splits times
+        """
+        item_ids = [item.item_id for item in items]
+        try:
+            price_response = await self.api.get_common_prices(company_id, item_ids)
+        except RequestError as e:
+            if not is_batch_too_large(e) or len(items) == 1 or not splits:
+                raise
+            half = len(items) // 2
+            logger.warning(f"batch of {len(items)} items was rejected with {e.status}, splitting it")
+            first, first_accepted = await self._get_common_prices(company_id, items[:half], splits - 1)
+            second, second_accepted = await self._get_common_prices(company_id, items[half:], splits - 1)
+            return first + second, min(first_accepted, second_accepted)
+        return price_response.items, len(items)
 
-    async def get_price_change(self, target_date: date, previous_date: date, limit: int = 50, offset: int = 0, company_id: str|None = None, offer_id: str|None = None) -> PriceChangeResponse:
-        async with session_maker() as session, session.begin():
-            ozon_prices = await get_ozon_price_change(session, target_date, previous_date, limit, offset, company_id, offer_id)
-            total = await count_ozon_price_change(session, target_date, previous_date, company_id, offer_id)
-            return PriceChangeResponse(price_changes=ozon_prices, total=total)
+    async def _save_prices(self, checkpoint: CollectionCheckpoint, prices_queue: asyncio.Queue, errors: list[Exception]):
+        saved = 0
+        # prices are committed with the checkpoint every commit_pages listing pages
+        rows: list[PriceRow] = []
+        pages = 0
+        while (batch := await prices_queue.get()) is not None:
+            items, prices, finished_pages = batch
+            rows.extend(self.convert_prices(items, prices, checkpoint.date))
+            saved += len(items)
+            checkpoint.items_saved += len(items)
+            if finished_pages:
+                checkpoint.next_offset, checkpoint.cursor, _ = finished_pages[-1]
+                checkpoint.pages_done += len(finished_pages)
+                pages += len(finished_pages)
+            if pages >= self.commit_pages:
+                await self.save_price_rows(rows, checkpoint)
+                rows = []
+                pages = 0
+        if rows or pages:
+            await self.save_price_rows(rows, checkpoint)
+        if not errors:
+            await finish_ozon_prices(checkpoint.company_id, checkpoint.date)
+            await refresh_price_change_daily(checkpoint.company_id, checkpoint.date)
+            checkpoint.finished = True
+            checkpoint.updated_at = datetime.now()
+            await save_checkpoint(checkpoint)
+        logger.info(f"saved {saved} products for {checkpoint.company_id}, {checkpoint.pages_done} pages done")
 
-    async def convert_and_save_ozon_prices(self, items: list[Item], prices: list[Price], today: date):
+    async def get_price_change(
+        self,
+        target_date: date,
+        previous_date: date | None = None,
+        limit: int = 50,
+        offset: int = 0,
+        company_id: str|None = None,
+        offer_id: str|None = None,
+        last_known: bool = False,
+        cursor: str | None = None,
+        field: str = 'ozon_card',
+        sort: str | None = None,
+        descending: bool = False,
+        min_pct: float | None = None,
+        changes: str | None = None
+    ) -> PriceChangeResponse:
+        """
+        Prices of target_date compared with previous_date (the last collected date before target_date by default)
+        or, with last_known, with the last known price of each SKU.
+        Pages are continued with the next_cursor or prev_cursor of the previous response.
+        Changes against the last collected date are read from the daily summary when it is refreshed,
+        it can be sorted and filtered by the change of a price field, see daily_price_change_query.
+        Sorting and change filters are not applied with last_known or previous_date
+        """
+        async with read_session_maker() as session, session.begin():
+            if previous_date is None and not last_known:
+                fresh = await is_fresh(session, target_date, [company_id] if company_id else None)
+                if fresh or sort or min_pct is not None or changes:
+                    return await get_daily_price_change(
+                        session, target_date, limit, offset, company_id, offer_id, cursor,
+                        field, sort, descending, min_pct, changes, live=not fresh
+                    )
+            return await get_ozon_price_change(
+                session, target_date, previous_date, limit, offset, company_id, offer_id,
+                last_known_before=target_date if last_known else None,
+                cursor=cursor
+            )
+
+    async def save_price_rows(self, rows: list[PriceRow], checkpoint: CollectionCheckpoint):
+        checkpoint.updated_at = datetime.now()
+        await save_price_rows(rows, checkpoint)
+
+    def convert_prices(self, items: list[Item], prices: list[Price], today: date) -> list[PriceRow]:
         price_map:dict[str, Price] = {price.item_id : price for price in prices}
-        ozon_prices = []
+        rows = []
         for item in items:
-            if item.item_id not in price_map:
-                logger.warning(f"price not found for {item}. it will not be saved")
             price = price_map.get(item.item_id)
-            ozon_prices.append(OzonPrice(
-                company_id=item.company_id,
-                item_id=item.item_id,
-                offer_id=item.part_item.offer_id,
-                name=item.part_item.name,
-                date=today,
-                marketing_seller_price=price.marketing_seller_price,
-                old_price=price.old_price,
-                marketing_price=price.marketing_price,
-                marketing_oa_price=price.marketing_oa_price
+            if price is None:
+                logger.warning(f"price not found for {item}. it will not be saved")
+                continue
+            rows.append(PriceRow(
+                item.company_id,
+                item.item_id,
+                item.part_item.offer_id,
+                item.part_item.name,
+                today,
+                price.marketing_seller_price,
+                price.old_price,
+                price.marketing_price,
+                price.marketing_oa_price
             ))
-        await save_ozon_prices(ozon_prices)
+        return rows
 
     async def prepare_excel_report(self, target_date: date, company_id: str|None = None, offer_id: str|None = None):
-        report_date = target_date.strftime("%Y-%m-%d")
         report_date_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        previous_date = (await get_previous_day(target_date)) or (target_date - timedelta(days=1))
-        base_path = await get_report_path()
-        if not base_path:
-            base_path = './'
-        else:
-            base_path = base_path.value
-
-        filename = os.path.join(base_path, f"price_changes_report_{report_date_time}_{company_id}.xlsx")
-        
-        # First check if there's any data
-        response = await self.get_price_change(
-            target_date=target_date,
-            previous_date=previous_date,
-            limit=1,
-            offset=0,
-            company_id=company_id,
-            offer_id=offer_id
-        )
-        
-        if not response.price_changes:
-            logger.warning(f"No price changes found for {report_date} and company {company_id}")
+        filename = os.path.join(await self.get_report_dir(), f"price_changes_report_{report_date_time}_{company_id}.xlsx")
+        reports = await self.render_reports(SINGLE, filename, target_date, company_id=company_id, offer_id=offer_id)
+        if not reports:
             return None
-            
-        limit = 50
-        offset = 0
-        first_page = True
-        
-        with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-            while True:
-                # Get price changes page by page
-                response = await self.get_price_change(
-                    target_date=target_date,
-                    previous_date=previous_date,
-                    limit=limit,
-                    offset=offset,
-                    company_id=company_id,
-                    offer_id=offer_id
-                )
-                
-                if not response.price_changes:
-                    break  # No more data
-                
-                # Convert to DataFrame
-                df = pd.DataFrame([price.model_dump() for price in response.price_changes])
-
-                column_order = [
-                    'offer_id',
-                    'name',
-                    'yesterday_seller_price',
-                    'yesterday_spp',
-                    'yesterday_ozon_card',
-                    'today_seller_price',
-                    'today_spp',
-                    'today_ozon_card',
-                ]
-
-                # Reorder columns
-                df = df[column_order]
-
-                # Rename columns for clarity
-                column_rename = {
-                    'today_seller_price': 'Цена Продажи ' + report_date,
-                    'today_spp': 'СПП ' + report_date,
-                    'today_ozon_card': 'Карта Озон ' + report_date,
-                    'yesterday_seller_price': 'Цена Продажи ' + previous_date.strftime("%Y-%m-%d"),
-                    'yesterday_spp': 'СПП ' + previous_date.strftime("%Y-%m-%d"),
-                    'yesterday_ozon_card': 'Карта Озон ' + previous_date.strftime("%Y-%m-%d")
-                }
-                df = df.rename(columns=column_rename)
-                
-                # Add empty column for formula
-                df['Изменение Цены %'] = None
-            
-                # Write to Excel
-                if first_page:
-                    # Write header on first page
-                    df.to_excel(writer, index=False, sheet_name='Price Changes')
-                    # Add formula after writing
-                    sheet = writer.sheets['Price Changes']
-                    for row in range(2, len(df) + 2):
-                        formula = f'=H{row}/E{row}'
-                        sheet.cell(row=row, column=len(df.columns)).value = formula
-                    first_page = False
-                else:
-                    # Append to existing sheet
-                    startrow = writer.sheets['Price Changes'].max_row
-                    df.to_excel(
-                        writer,
-                        index=False,
-                        sheet_name='Price Changes',
-                        startrow=startrow,
-                        header=False
-                    )
-                    # Add formula for new rows
-                    sheet = writer.sheets['Price Changes']
-                    for row in range(startrow + 1, startrow + len(df) + 1):
-                        formula = f'=H{row}/E{row}'
-                        sheet.cell(row=row, column=len(df.columns)).value = formula
-
-                offset += limit
-                logger.info(f"written {offset} of {response.total} rows to excel")
-
-                # Stop if we've processed all items
-                if offset >= response.total:
-                    break
-        
         logger.info(f"Report saved as {filename}")
         return filename
 
+    async def prepare_reports(self, target_date: date, company_ids: list[str], mode: str = REPORT_MODE) -> dict[str, str]:
+        """
+        Reports of several companies from a single scan of the prices of target_date:
+        a workbook per company in the company mode, one workbook with a sheet per company in the consolidated mode.
+        Returns the report file of every company that has prices
+        """
+        report_date_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        if mode == CONSOLIDATED:
+            name = f"price_changes_report_{report_date_time}_all.xlsx"
+        else:
+            mode = COMPANY
+            name = f"price_changes_report_{report_date_time}_{COMPANY_PLACEHOLDER}.xlsx"
+        filename = os.path.join(await self.get_report_dir(), name)
+        reports = await self.render_reports(mode, filename, target_date, company_ids=company_ids)
+        for company_id, (report, rows) in reports.items():
+            logger.info(f"Report of {company_id} with {rows} rows saved as {report}")
+        return {company_id: report for company_id, (report, _) in reports.items()}
+
+    async def get_report_dir(self) -> str:
+        return await get_report_path() or './'
+
+    async def render_reports(
+        self,
+        mode: str,
+        filename: str,
+        target_date: date,
+        company_id: str|None = None,
+        offer_id: str|None = None,
+        company_ids: list[str] | None = None
+    ) -> dict[str, tuple[str, int]]:
+        report_date = target_date.strftime("%Y-%m-%d")
+        async with read_session_maker() as session, session.begin():
+            daily = await is_fresh(session, target_date, [company_id] if company_id else company_ids)
+            # a single streamed query without counting its rows first, the previous date is resolved by it
+            # and comes with the rows. The rows are rendered by the report pool outside the event loop
+            if daily:
+                chunks = stream_daily_price_changes(session, target_date, company_id, offer_id, company_ids)
+            else:
+                chunks = stream_price_changes(session, target_date, None, company_id, offer_id, company_ids)
+            reports = await self.report_pool.render(mode, filename, target_date, chunks)
+        if not reports:
+            logger.warning(f"No price changes found for {report_date} and company {company_id or company_ids}")
+            return {}
+        logger.info(f"written {sum(rows for _, rows in reports.values())} rows to excel")
+        return reports
+
 
 async def main():
     ...
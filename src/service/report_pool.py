@@ -0,0 +1,151 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date
+
+from src.config import REPORT_MAX_CONCURRENT_JOBS, REPORT_PROCESS_THRESHOLD_ROWS, REPORT_QUEUE_SIZE
+from src.service.excel_report import ROW_COLUMNS, discard_report, finish_report, start_report, write_report_rows
+
+logger = logging.getLogger(__name__)
+
+def report_rows(chunk) -> list[tuple]:
+    return [tuple(getattr(row, column) for column in ROW_COLUMNS) for row in chunk]
+
+class ReportSlot:
+    """
+    A thread and a process that render one report at a time. Each has a single worker,
+    so the chunks of a report are written by the same worker in the order they are submitted
+    """
+
+    def __init__(self, index: int):
+        self.index = index
+        self.thread_pool: ThreadPoolExecutor | None = None
+        self.process_pool: ProcessPoolExecutor | None = None
+        self.lock = threading.Lock()
+
+    def executor(self, in_process: bool) -> Executor:
+        with self.lock:
+            if in_process:
+                if self.process_pool is None:
+                    # spawn, the parent has database and browser threads that must not be forked.
+                    # The worker only imports src.service.excel_report for the submitted functions
+                    self.process_pool = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"))
+                    # the worker is started by the first task, start it here instead of on the loop
+                    self.process_pool.submit(int).result()
+                return self.process_pool
+            if self.thread_pool is None:
+                self.thread_pool = ThreadPoolExecutor(1, thread_name_prefix=f"report-{self.index}")
+            return self.thread_pool
+
+    def shutdown(self):
+        if self.thread_pool is not None:
+            self.thread_pool.shutdown(wait=False, cancel_futures=True)
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+
+class ReportPool:
+    """
+    Renders reports outside the event loop: in a thread for small reports, in a process for big ones.
+    The async side submits the chunks of rows to the worker of the report, at most queue_size chunks wait,
+    and awaits the result.
+    Rows are not counted beforehand, up to process_threshold rows are read ahead to choose the worker
+    """
+
+    def __init__(
+        self,
+        max_jobs: int = REPORT_MAX_CONCURRENT_JOBS,
+        process_threshold: int = REPORT_PROCESS_THRESHOLD_ROWS,
+        queue_size: int = REPORT_QUEUE_SIZE
+    ):
+        self.max_jobs = max(1, max_jobs)
+        self.process_threshold = process_threshold
+        self.queue_size = max(1, queue_size)
+        self.slots = [ReportSlot(index) for index in range(self.max_jobs)]
+        self.free_slots: asyncio.Queue | None = None
+        self.job_ids = itertools.count(1)
+
+    async def _acquire_slot(self) -> ReportSlot:
+        # the queue belongs to the running loop, it is created by the first report
+        if self.free_slots is None:
+            self.free_slots = asyncio.Queue()
+            for slot in self.slots:
+                self.free_slots.put_nowait(slot)
+        return await self.free_slots.get()
+
+    async def render(
+        self,
+        mode: str,
+        filename: str,
+        target_date: date,
+        chunks
+    ) -> dict[str, tuple[str, int]]:
+        """
+        Write the chunks of rows of an async iterator, see ReportRenderer. Nothing is written without rows
+        """
+        slot = await self._acquire_slot()
+        try:
+            return await self._render(slot, mode, filename, target_date, chunks)
+        finally:
+            self.free_slots.put_nowait(slot)
+
+    async def _render(
+        self,
+        slot: ReportSlot,
+        mode: str,
+        filename: str,
+        target_date: date,
+        chunks
+    ) -> dict[str, tuple[str, int]]:
+        head = []
+        head_rows = 0
+        async for chunk in chunks:
+            head.append(chunk)
+            head_rows += len(chunk)
+            if self.process_threshold > 0 and head_rows >= self.process_threshold:
+                break
+        if not head_rows:
+            return {}
+        in_process = self.process_threshold > 0 and head_rows >= self.process_threshold
+        # starting the process takes a while, it should not stall the loop
+        executor = await asyncio.to_thread(slot.executor, in_process)
+        logger.info(
+            f"rendering {'at least ' if in_process else ''}{head_rows} rows to {filename} "
+            f"in a {'process' if in_process else 'thread'}"
+        )
+        loop = asyncio.get_running_loop()
+        job_id = next(self.job_ids)
+        pending = deque([loop.run_in_executor(
+            executor, start_report, job_id, mode, filename, target_date
+        )])
+
+        async def submit(chunk):
+            # the worker is behind, wait for the oldest chunk, its error stops the report
+            if len(pending) >= self.queue_size:
+                await pending.popleft()
+            pending.append(loop.run_in_executor(executor, write_report_rows, job_id, report_rows(chunk)))
+
+        try:
+            for chunk in head:
+                await submit(chunk)
+            # the rest of the chunks after the ones read ahead
+            async for chunk in chunks:
+                await submit(chunk)
+            while pending:
+                await pending.popleft()
+            return await loop.run_in_executor(executor, finish_report, job_id)
+        except BaseException:
+            # the chunks already submitted are written before the report is dropped
+            await asyncio.gather(*pending, return_exceptions=True)
+            try:
+                await loop.run_in_executor(executor, discard_report, job_id)
+            except Exception:
+                logger.exception(f"discarding {filename} failed")
+            raise
+
+    def shutdown(self):
+        for slot in self.slots:
+            slot.shutdown()
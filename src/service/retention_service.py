@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import logging
+import os
+from datetime import date, timedelta
+
+from sqlalchemy import select
+
+from src.config import PRICE_ARCHIVE_AFTER_DAYS, PRICE_ARCHIVE_DIR, PRICE_RETENTION_DAYS, STORAGE_MODE
+from src.models.database import dispose_engines, read_session_maker, session_maker
+from src.persistence.ozon_price_db import INCREMENTAL, PRICE_HISTORY_COLUMNS
+from src.persistence.partition_db import drop_partition, get_partitions, month_start, partition_month, \
+    partition_table, unpartitioned_months
+
+logger = logging.getLogger(__name__)
+
+async def partition_prices(today: date, retention_days: int = PRICE_RETENTION_DAYS) -> list[date]:
+    """
+    Months that ended more than retention_days ago are moved out of OzonPrice to weekly partitions,
+    so the hot table and its indexes keep only the recent months. Returns the moved months
+    """
+    before = month_start(today - timedelta(days=retention_days))
+    async with read_session_maker() as session:
+        months = await unpartitioned_months(session, before)
+        partitions = await get_partitions(session)
+    if months and not partitions:
+        logger.warning(
+            f"first retention pass: daily prices before {before} are replaced by weekly prices "
+            f"in OzonPrice_YYYY_MM tables, the other daily prices are deleted for good"
+        )
+    archived = {partition.month for partition in partitions if partition.archive_path}
+    moved = []
+    for month in months:
+        if month in archived:
+            logger.warning(f"prices of {month:%Y-%m} are left in OzonPrice, the month is archived already")
+            continue
+        # a transaction per month, the hot table is not locked for the whole run
+        async with session_maker() as session, session.begin():
+            await partition_month(session, month)
+        moved.append(month)
+    return moved
+
+async def archive_partitions(
+    today: date,
+    archive_after_days: int = PRICE_ARCHIVE_AFTER_DAYS,
+    archive_dir: str = PRICE_ARCHIVE_DIR
+) -> list[str]:
+    """
+    Partitions of the months that ended more than archive_after_days ago are written to zstd parquet files
+    and dropped from the database. Needs pyarrow, it is an optional dependency
+    """
+    before = month_start(today - timedelta(days=archive_after_days))
+    async with read_session_maker() as session:
+        partitions = await get_partitions(session)
+    to_archive = [partition for partition in partitions if partition.month < before and not partition.archive_path]
+    if not to_archive:
+        return []
+    if not any(partition.archive_path for partition in partitions):
+        logger.warning(
+            f"first archive pass: weekly prices before {before} are moved to {archive_dir} "
+            f"and dropped from the database"
+        )
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("archiving prices needs pyarrow: uv sync --extra parquet") from e
+
+    schema = pa.schema([
+        ('date', pa.date32()),
+        ('company_id', pa.string()),
+        ('item_id', pa.string()),
+        ('offer_id', pa.string()),
+        ('name', pa.string()),
+        ('marketing_seller_price', pa.float64()),
+        ('old_price', pa.float64()),
+        ('marketing_price', pa.float64()),
+        ('marketing_oa_price', pa.float64()),
+    ])
+    os.makedirs(archive_dir, exist_ok=True)
+    paths = []
+    for partition in to_archive:
+        path = os.path.join(archive_dir, f"{partition.table_name}.parquet")
+        # the file gets its name when it is complete, a failed run leaves the partition in the database
+        temporary_path = path + ".tmp"
+        table = partition_table(partition.table_name)
+        query = select(*(table.c[column] for column in PRICE_HISTORY_COLUMNS)).order_by(*table.primary_key.columns)
+        writer = pq.ParquetWriter(temporary_path, schema, compression="zstd")
+        try:
+            async with read_session_maker() as session, session.begin():
+                result = await session.stream(query.execution_options(yield_per=5000))
+                async for rows in result.partitions():
+                    batch = pa.record_batch([[row[i] for row in rows] for i in range(len(schema))], schema=schema)
+                    await asyncio.to_thread(writer.write_batch, batch)
+        finally:
+            writer.close()
+        os.replace(temporary_path, path)
+        async with session_maker() as session, session.begin():
+            await drop_partition(session, partition, path)
+        paths.append(path)
+    return paths
+
+async def apply_retention(
+    today: date,
+    retention_days: int = PRICE_RETENTION_DAYS,
+    archive_after_days: int = PRICE_ARCHIVE_AFTER_DAYS,
+    archive_dir: str = PRICE_ARCHIVE_DIR
+) -> tuple[list[date], list[str]]:
+    """
+    Retention policy of the collected prices, a zero period turns its step off.
+    The incremental storage keeps only the changes of prices, it is not partitioned
+    """
+    if STORAGE_MODE == INCREMENTAL:
+        logger.info("prices are stored incrementally, retention is skipped")
+        return [], []
+    moved = await partition_prices(today, retention_days) if retention_days else []
+    archived = await archive_partitions(today, archive_after_days, archive_dir) if archive_after_days else []
+    return moved, archived
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old prices to weekly monthly partitions and archive cold ones")
+    parser.add_argument("--today", type=date.fromisoformat, default=date.today())
+    parser.add_argument("--retention-days", type=int, default=PRICE_RETENTION_DAYS)
+    parser.add_argument("--archive-after-days", type=int, default=PRICE_ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--archive-dir", default=PRICE_ARCHIVE_DIR)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(args))
+
+async def run(args):
+    moved, archived = await apply_retention(args.today, args.retention_days, args.archive_after_days, args.archive_dir)
+    print(f"moved {len(moved)} months to partitions, archived {len(archived)} partitions")
+    await dispose_engines()
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,26 @@
+import asyncio
+
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
+from src.config import COLLECTION_CONCURRENCY
 from src.models.task import Task
 from src.persistence.parameters_db import get_company_ids, get_scheduled_times
 import logging
 
-from datetime import datetime
+from datetime import date, datetime
 
 from src.persistence.task_db import save_task
 from src.service.ozon_service import OzonService
+from src.service.retention_service import apply_retention
 
 logger = logging.getLogger(__name__)
 
 
 class ScedulerService:
-    def __init__(self, ozon_servie: OzonService):
+    def __init__(self, ozon_servie: OzonService, concurrency: int = COLLECTION_CONCURRENCY):
         self.scheduler = AsyncIOScheduler()
         self.ozon_service = ozon_servie
+        self.concurrency = max(1, concurrency)
         self._is_running = False
         self.task = None
 
@@ -41,27 +46,71 @@ class ScedulerService:
             self.scheduler.start()
 
     async def test_job(self):
-        task = None
         if  self._is_running:
             logger.warning("job is already running skipping this one")
             return
+        self._is_running = True
         try:
             date = datetime.now().date()
             company_ids = await get_company_ids()
+            tasks = []
             for company_id in company_ids:
-                try:
-                    task = Task(name=company_id, status='getting prices')
-                    await save_task(task)
-                    await self.ozon_service.get_ozon_prices(date, company_id)
-                    task.status = 'generating report'
-                    await save_task(task)
-                    await self.ozon_service.prepare_excel_report(date, company_id)
-                    task.status = 'FINISHED'
-                    await save_task(task)
-                except Exception as e:
-                    logger.exception(e)
-                    if task:
-                        task.status = "ERROR: " + str(e)
-                        await save_task(task)
+                task = Task(name=company_id, status='queued')
+                await save_task(task)
+                tasks.append(task)
+            try:
+                await self.ozon_service.open_browser()
+            except Exception as e:
+                logger.exception(e)
+                for task in tasks:
+                    await self.set_status(task, "ERROR: " + str(e))
+                return
+            # companies are collected by a bounded pool of workers sharing one long-lived browser
+            semaphore = asyncio.Semaphore(self.concurrency)
+            collected = await asyncio.gather(*(
+                self.collect_company(semaphore, date, task) for task in tasks
+            ))
+            # reports of all collected companies are made once from a single scan of the prices
+            await self.generate_reports(date, [task for task, ok in zip(tasks, collected) if ok])
+            await self.retain_prices(date)
         finally:
             self._is_running = False
+
+    async def collect_company(self, semaphore: asyncio.Semaphore, today: date, task: Task) -> bool:
+        company_id = task.name
+        async with semaphore:
+            try:
+                await self.set_status(task, 'getting prices')
+                await self.ozon_service.get_ozon_prices(today, company_id)
+                await self.set_status(task, 'waiting for report')
+                return True
+            except Exception as e:
+                logger.exception(e)
+                await self.set_status(task, "ERROR: " + str(e))
+                return False
+
+    async def generate_reports(self, today: date, tasks: list[Task]):
+        if not tasks:
+            return
+        for task in tasks:
+            await self.set_status(task, 'generating report')
+        try:
+            await self.ozon_service.prepare_reports(today, [task.name for task in tasks])
+        except Exception as e:
+            logger.exception(e)
+            for task in tasks:
+                await self.set_status(task, "ERROR: " + str(e))
+            return
+        for task in tasks:
+            await self.set_status(task, 'FINISHED')
+
+    async def retain_prices(self, today: date):
+        # old months leave the hot price table once a day, when collection is over
+        try:
+            await apply_retention(today)
+        except Exception as e:
+            logger.exception(e)
+
+    async def set_status(self, task: Task, status: str):
+        task.status = status
+        await save_task(task)